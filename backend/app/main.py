@@ -3,8 +3,11 @@
 
 from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Query, Response, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 import pandas as pd
 import polars as pl
+import pyarrow as pa
+import pyarrow.compute as pc
 import duckdb
 import io
 import json
@@ -14,18 +17,37 @@ import tempfile
 import uuid
 import shutil
 import numpy as np
+import orjson
 import traceback
 import ast # Import Abstract Syntax Trees for code parsing
+import asyncio
+import collections
+import concurrent.futures
+import functools
+import multiprocessing
+import threading
 from typing import Optional, List, Dict, Any, Union, Tuple
 from pandas.errors import DataError, ParserError, EmptyDataError
 
 # Use relative import if services is a package in the same directory as main's parent
 # Services might be less used now, code execution is central
 from .services import pandas_service, sql_service, relational_algebra_service, polars_service # pandas/polars services less critical now
+from .services import storage_service # Content storage (in-memory bytes or mmap-backed spill files)
 
 TEMP_UPLOAD_DIR = tempfile.gettempdir()
+HISTOGRAM_BINS = 10 # Bars in the column stats panel's histogram
+PROFILE_GROUPING_SET_COLUMNS = 32 # Low-cardinality columns counted per GROUPING SETS query in dataset-info
 print(f"Using temporary directory: {TEMP_UPLOAD_DIR}")
-app = FastAPI(title="Data Analysis GUI API - Multi-Dataset")
+
+class ORJSONResponse(JSONResponse):
+    """
+    JSON rendered by orjson: handles NumPy scalars/NaN natively, is much faster for large previews and embeds
+    the pre-serialized orjson.Fragment preview rows as-is. Defined here since FastAPI deprecates its own.
+    """
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+
+app = FastAPI(title="Data Analysis GUI API - Multi-Dataset", default_response_class=ORJSONResponse)
 
 # Configure CORS
 app.add_middleware(
@@ -38,25 +60,142 @@ app.add_middleware(
         "https://datamaid.netlify.app"
     ],
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=["GET", "POST", "DELETE"], # Explicit lists (no "*") so browsers can cache the preflight
+    allow_headers=["content-type"],
+    max_age=86400, # Cache preflight responses for a day
 )
 
 # --- In-memory State for Multiple Datasets ---
 # Key: dataset_name (string)
 # Value: Dict {
-#   "content": bytes (CSV format),
+#   "content": bytes (Arrow IPC; CSV only as fallback, see storage_service.is_arrow_ipc) | storage_service.SpilledContent (large, mmap-backed temp file),
 #   "type": "dataframe" | "series",
 #   "origin": "upload" | "code" | "ra" | "db",
 #   "original_filename": Optional[str],
-#   "history": List[bytes] (optional, for simple undo)
+#   "history": List[Dict | bytes] (optional, for simple undo; content may be spilled, see _enforce_memory_budget),
+#   "columns": List[str], "row_count": int (cached metadata of the current content, see _content_metadata)
 # }
 datasets_state: Dict[str, Dict[str, Any]] = {}
 
+# Dataset names by last request that touched them (least recent first), for spilling cold content
+_dataset_last_used: "collections.OrderedDict[str, None]" = collections.OrderedDict()
+
+# Per-dataset locks: operations, undo/reset and code execution read a dataset's state, compute in a
+# cpu_pool thread, then write content/history/sql_chain back; the lock keeps two of them from interleaving.
+_dataset_locks: Dict[str, threading.RLock] = {}
+
 # Stores paths to temporary DB files for import process
 temp_db_files: Dict[str, str] = {}
 
+# Worker pool for CPU-bound DataFrame work (operations, code execution, stats) so the
+# event loop keeps serving other requests. Polars and DuckDB release the GIL for most work.
+cpu_pool = concurrent.futures.ThreadPoolExecutor(max_workers=os.cpu_count())
+# Pandas merge/regex work holds the GIL, so it goes to worker processes (spawned, not forked,
+# since this process runs DuckDB/polars threads). Workers start on first use.
+process_pool = concurrent.futures.ProcessPoolExecutor(max_workers=os.cpu_count(), mp_context=multiprocessing.get_context("spawn"))
+
+# Shared in-memory DuckDB database: catalog, buffer manager and thread pool are set up once.
+# Requests work on their own cursor (cheap) scoped to a scratch schema, see _open_duckdb_cursor.
+_duckdb = duckdb.connect(":memory:")
+
+@app.middleware("http")
+async def track_dataset_memory(request, call_next):
+    """Records which dataset a request used and, after requests that can add content, enforces the memory budget."""
+    response = await call_next(request)
+    dataset_name = request.scope.get("path_params", {}).get("dataset_name") # Filled in by the router
+    if dataset_name in datasets_state:
+        _dataset_last_used.pop(dataset_name, None)
+        _dataset_last_used[dataset_name] = None
+    if request.method == "POST":
+        await _run_in_cpu_pool(_enforce_memory_budget)
+    return response
+
+def _enforce_memory_budget():
+    """
+    Spills in-memory content to mmap-backed files until it fits storage_service.MEMORY_BUDGET_BYTES:
+    undo history first (oldest steps first), then current content of the least recently used datasets.
+    Datasets whose lock is held (a request is rewriting their state) are skipped; a later pass gets them.
+    """
+    locked = [] # Held until the references are swapped
+    try:
+        entries = {}
+        for name, entry in list(datasets_state.items()):
+            lock = _dataset_lock(name)
+            if lock.acquire(blocking=False):
+                locked.append(lock)
+                entries[name] = entry
+        _spill_to_budget(entries)
+    finally:
+        for lock in locked:
+            lock.release()
+
+def _spill_to_budget(entries: Dict[str, Dict[str, Any]]):
+    """Spills content of the given datasets_state entries (see _enforce_memory_budget)."""
+    holders = [] # (container, key) in spill order; history steps are dicts or plain content
+    for entry in entries.values():
+        history = entry.get("history") or []
+        for i, step in enumerate(history):
+            holders.append((step, "previous_content") if isinstance(step, dict) else (history, i))
+    recency = {name: i for i, name in enumerate(_dataset_last_used)}
+    for name in sorted(entries.keys(), key=lambda name: recency.get(name, -1)): # Never touched counts as coldest
+        holders.append((entries[name], "content"))
+
+    resident = {}
+    for container, key in holders:
+        content = container[key] if isinstance(container, list) else container.get(key)
+        if isinstance(content, bytes):
+            resident[id(content)] = len(content) # The same bytes can back several entries (e.g. saved copies)
+    total = sum(resident.values())
+    if total <= storage_service.MEMORY_BUDGET_BYTES:
+        return
+
+    spilled = {}
+    for container, key in holders:
+        if total <= storage_service.MEMORY_BUDGET_BYTES:
+            break
+        content = container[key] if isinstance(container, list) else container.get(key)
+        if isinstance(content, bytes) and id(content) not in spilled:
+            spilled[id(content)] = storage_service.spill(content)
+            total -= len(content)
+    for container, key in holders: # Swap every reference, so the bytes are actually released
+        content = container[key] if isinstance(container, list) else container.get(key)
+        if isinstance(content, bytes) and id(content) in spilled:
+            container[key] = spilled[id(content)]
+    print(f"Memory budget: spilled {len(spilled)} content object(s), {total} bytes still in memory.")
+
 # --- Helper Functions ---
+async def _run_in_cpu_pool(func, *args):
+    """Runs a blocking function in cpu_pool and awaits its result (exceptions propagate)."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(cpu_pool, functools.partial(func, *args))
+
+def _dataset_lock(dataset_name: str) -> threading.RLock:
+    """Lock guarding read-modify-write of datasets_state[dataset_name] (created on first use)."""
+    return _dataset_locks.setdefault(dataset_name, threading.RLock())
+
+def _with_dataset_lock(dataset_name: str, func, *args):
+    """Runs func(*args) holding the dataset's lock, so its state is read and written back by one request at a time."""
+    with _dataset_lock(dataset_name):
+        return func(*args)
+
+def _open_duckdb_cursor() -> duckdb.DuckDBPyConnection:
+    """Opens a per-request cursor on the shared DuckDB database with its own scratch schema."""
+    con = _duckdb.cursor()
+    schema_name = f"req_{uuid.uuid4().hex}"
+    con.execute(f'CREATE SCHEMA "{schema_name}";')
+    con.execute(f"SET schema = '{schema_name}';") # Unqualified CREATE TABLE lands here, not in the shared main schema
+    return con
+
+def _close_duckdb_cursor(con: duckdb.DuckDBPyConnection):
+    """Drops the cursor's scratch schema (tables created by the request) and closes it. Safe to call twice."""
+    try:
+        schema_name = con.execute("SELECT current_schema();").fetchone()[0]
+        if schema_name.startswith("req_"):
+            con.execute(f'DROP SCHEMA IF EXISTS "{schema_name}" CASCADE;')
+    except duckdb.Error:
+        pass # Cursor already closed
+    con.close()
+
 def _sanitize_variable_name(name: str) -> str:
     """Converts a dataset name into a valid Python variable name."""
     if not name: return 'data' # Changed default
@@ -70,6 +209,19 @@ def _sanitize_variable_name(name: str) -> str:
     # Handle potential empty string after sanitization
     return s_name if s_name else 'data'
 
+@functools.lru_cache(maxsize=128)
+def _compile_user_code(code: str) -> Tuple[Any, frozenset]:
+    """
+    Parses user code once into a code object plus the names it assigns (assignment targets).
+    Cached, so re-running the same snippet skips parsing and compiling. SyntaxError propagates.
+    """
+    tree = ast.parse(code, filename="<user-code>")
+    assigned_vars = frozenset(
+        target.id for node in ast.walk(tree) if isinstance(node, ast.Assign)
+        for target in node.targets if isinstance(target, ast.Name)
+    )
+    return compile(tree, "<user-code>", "exec"), assigned_vars
+
 def cleanup_temp_file(file_path: str, delay: int = 0):
      # Placeholder: Implement actual delayed cleanup if needed
      if os.path.exists(file_path):
@@ -79,56 +231,77 @@ def cleanup_temp_file(file_path: str, delay: int = 0):
          except OSError as e:
              print(f"Error cleaning up temp file {file_path}: {e}")
 
-def _determine_type_and_content(data: Union[pd.DataFrame, pd.Series]) -> Tuple[str, bytes]:
-    """Determines if data is DataFrame or Series and returns type string and CSV bytes."""
-    content_bytes: bytes
+def _determine_type_and_content(data: Union[pd.DataFrame, pd.Series, pa.Table]) -> Tuple[str, storage_service.Content]:
+    """Determines if data is DataFrame or Series and returns type string and stored (Arrow IPC) content."""
     data_type: str
+    if isinstance(data, pa.Table): # Query results straight from DuckDB
+        return "dataframe", storage_service.store_arrow(data)
     if isinstance(data, pd.DataFrame):
         data_type = "dataframe"
-        with io.BytesIO() as buffer:
-            data.to_csv(buffer, index=False)
-            content_bytes = buffer.getvalue()
     elif isinstance(data, pd.Series):
-        data_type = "series"
-        # Store Series as a single-column DataFrame CSV
-        df_temp = data.to_frame()
-        with io.BytesIO() as buffer:
-            df_temp.to_csv(buffer, index=False)
-            content_bytes = buffer.getvalue()
+        data_type = "series" # Stored as a single-column table
     else:
         raise TypeError(f"Unsupported data type for state storage: {type(data)}")
-    return data_type, content_bytes
+    return data_type, storage_service.store_pandas(data)
 
-def _get_preview_from_content(content: bytes, data_type: str = 'csv', limit: int = 100, offset: int = 0) -> Dict:
-    """Generates preview dict from content bytes based on data_type."""
+def _content_metadata(data: Union[pd.DataFrame, pd.Series, pl.DataFrame, pa.Table]) -> Dict[str, Any]:
+    """Columns/row_count of data about to be stored, cached on the state entry alongside its content."""
+    if isinstance(data, pa.Table):
+        frame_columns = data.column_names
+    else:
+        frame_columns = data.to_frame().columns if isinstance(data, pd.Series) else data.columns # Series are stored as one column
+    return {"columns": [str(col) for col in frame_columns], "row_count": len(data)}
+
+def _cached_metadata(state_entry: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Returns the cached columns/row_count for the entry's current content, if present."""
+    if "columns" in state_entry and "row_count" in state_entry:
+        return {"columns": state_entry["columns"], "row_count": state_entry["row_count"]}
+    return None
+
+def _preview_from_df(df: Union[pd.DataFrame, pd.Series, pl.DataFrame], content: storage_service.Content, limit: int = 100) -> Dict:
+    """
+    Preview dict (same shape as _get_preview_from_content) from a result still in memory,
+    so callers that just produced the frame don't re-read the stored content.
+    Frames Arrow cannot type (e.g. mixed-type object columns, stored as CSV) are previewed from content instead.
+    """
+    metadata = _content_metadata(df)
+    if isinstance(df, pd.Series): df = df.to_frame()
+    try:
+        preview_df = df.head(limit) if isinstance(df, pl.DataFrame) else pl.from_pandas(df.head(limit))
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError) as e:
+        print(f"Preview from stored content, Arrow conversion failed: {type(e).__name__}: {e}")
+        return _get_preview_from_content(content, limit=limit, metadata=metadata)
+    return {"data": orjson.Fragment(preview_df.write_json(row_oriented=True)), **metadata}
+
+def _can_undo(dataset_name: str) -> bool:
+    """Undo (and reset, which clears history) is available once the dataset has history."""
+    state_entry = datasets_state.get(dataset_name)
+    return bool(state_entry and state_entry.get("history"))
+
+def _get_preview_from_content(content: storage_service.Content, data_type: str = 'csv', limit: int = 100, offset: int = 0, metadata: Optional[Dict[str, Any]] = None) -> Dict:
+    """
+    Generates preview dict from content bytes based on data_type.
+    If cached metadata (columns/row_count) is given, only the requested rows are parsed.
+    "data" is a pre-serialized orjson.Fragment (row-oriented JSON written by polars), so
+    endpoints embedding it must return an ORJSONResponse directly.
+    """
     try:
         if not content: return {"data": [], "columns": [], "row_count": 0}
 
-        df = None
-        if data_type == 'csv':
-            df = pd.read_csv(io.BytesIO(content))
-        # Add elif for other types like 'parquet' if needed in the future
-        # elif data_type == 'parquet':
-        #     df = pd.read_parquet(io.BytesIO(content))
+        if metadata is not None:
+            preview_df = storage_service.read_polars_slice(content, offset, limit)
+            columns, row_count = metadata["columns"], metadata["row_count"]
         else:
-            # Fallback or error for unsupported types
-            print(f"Preview Warning: Unsupported data_type '{data_type}', attempting CSV read.")
-            df = pd.read_csv(io.BytesIO(content)) # Try CSV as default
+            # Stored content (IPC, or CSV fallback) as an Arrow table; only the requested page is converted
+            return _get_preview_from_table(storage_service.read_arrow(content), limit, offset)
 
-        # Handle potential non-serializable types during preview generation
-        preview_df = df.iloc[offset:offset+limit].copy()
-        for col in preview_df.columns:
-            if pd.api.types.is_datetime64_any_dtype(preview_df[col]):
-                 preview_df[col] = preview_df[col].astype(str)
-            # Add more type handling here if needed
-
-        # Replace inf/-inf with None, fill NaN with 'NaN' string
-        data_list = preview_df.replace([np.inf, -np.inf], None).fillna('NaN').to_dict(orient="records")
+        # Polars writes the rows straight to JSON: datetimes as strings, NaN/inf/missing as null
+        data_list = orjson.Fragment(preview_df.write_json(row_oriented=True))
 
         return {
             "data": data_list,
-            "columns": list(df.columns),
-            "row_count": len(df)
+            "columns": columns,
+            "row_count": row_count
         }
     except (ParserError, EmptyDataError) as pe:
         print(f"Preview Error ({data_type}): {pe}")
@@ -138,6 +311,15 @@ def _get_preview_from_content(content: bytes, data_type: str = 'csv', limit: int
         traceback.print_exc()
         return {"data": [], "columns": [], "row_count": 0, "error": f"Preview failed ({data_type}): {str(e)}"}
 
+def _get_preview_from_table(table: pa.Table, limit: int = 100, offset: int = 0) -> Dict:
+    """Preview dict (same shape as _get_preview_from_content) of an in-memory Arrow table; only the requested page is converted."""
+    preview_df = pl.from_arrow(table.slice(offset, limit))
+    return {
+        "data": orjson.Fragment(preview_df.write_json(row_oriented=True)),
+        "columns": table.column_names,
+        "row_count": table.num_rows
+    }
+
 # --- Basic Endpoints ---
 @app.get("/")
 async def read_root():
@@ -166,22 +348,24 @@ async def upload_file(file: UploadFile = File(...), dataset_name: str = Form(...
     try:
         # Attempt to read as CSV first
         try:
-            df = pd.read_csv(io.BytesIO(contents))
+            table = storage_service.parse_csv(contents) # Multi-threaded pyarrow reader, straight to Arrow
             # Check if it's likely a Series (single column)
-            if len(df.columns) == 1:
+            if table.num_columns == 1:
                 # Heuristic: If it has one column, treat as Series for type hint
                 # but store as DataFrame CSV for consistency
                 data_type = "series"
                 print(f"Detected single column, treating '{dataset_name}' as Series type.")
-            # Re-serialize to ensure consistent CSV format
-            data_type, content_bytes = _determine_type_and_content(df)
+            # Store as Arrow IPC (also primes the decoded-table cache for the preview)
+            data_type, content_bytes = _determine_type_and_content(table)
+            metadata = _content_metadata(table)
 
-        except (ParserError, EmptyDataError, UnicodeDecodeError):
+        except (pa.ArrowInvalid, UnicodeDecodeError):
             # If CSV fails, try JSON (records orientation)
             try:
                 df_json = pd.read_json(io.StringIO(contents.decode('utf-8')), orient="records")
                 # Determine type and serialize back to CSV
                 data_type, content_bytes = _determine_type_and_content(df_json)
+                metadata = _content_metadata(df_json)
                 original_filename += ".csv" # Indicate stored format change
                 print(f"Successfully parsed uploaded file '{file.filename}' as JSON records.")
             except Exception as json_err:
@@ -197,12 +381,13 @@ async def upload_file(file: UploadFile = File(...), dataset_name: str = Form(...
             "type": data_type,
             "origin": "upload",
             "original_filename": original_filename,
-            "history": [] # Initialize history
+            "history": [], # Initialize history
+            **metadata
         }
 
-        preview_info = _get_preview_from_content(content_bytes, data_type, limit=100)
+        preview_info = _get_preview_from_content(content_bytes, data_type, limit=100, metadata=metadata)
 
-        return {
+        return ORJSONResponse({
             "message": f"Successfully uploaded {file.filename} as '{dataset_name}' ({data_type})",
             "dataset_name": dataset_name,
             "dataset_type": data_type,
@@ -210,7 +395,7 @@ async def upload_file(file: UploadFile = File(...), dataset_name: str = Form(...
             "columns": preview_info.get("columns", []),
             "row_count": preview_info.get("row_count", 0),
             "datasets": sorted(list(datasets_state.keys())) # Return all names
-        }
+        })
     except HTTPException as http_err: raise http_err
     except Exception as e:
         print(f"Unexpected Upload error: {type(e).__name__}: {e}")
@@ -252,6 +437,7 @@ async def upload_text_data(
 
         # Determine type and serialize to CSV bytes
         data_type, content_bytes = _determine_type_and_content(df)
+        metadata = _content_metadata(df)
         if data_type == "series":
              print(f"Detected single column from text, treating '{dataset_name}' as Series type.")
 
@@ -263,12 +449,13 @@ async def upload_text_data(
             "type": data_type,
             "origin": "upload",
             "original_filename": original_filename,
-            "history": []
+            "history": [],
+            **metadata
         }
 
-        preview_info = _get_preview_from_content(content_bytes, data_type, limit=100)
+        preview_info = _get_preview_from_content(content_bytes, data_type, limit=100, metadata=metadata)
 
-        return {
+        return ORJSONResponse({
             "message": f"Successfully loaded data as '{dataset_name}' ({data_type})",
             "dataset_name": dataset_name,
             "dataset_type": data_type,
@@ -276,7 +463,7 @@ async def upload_text_data(
             "columns": preview_info.get("columns", []),
             "row_count": preview_info.get("row_count", 0),
             "datasets": sorted(list(datasets_state.keys())) # Return all names
-        }
+        })
     except (ParserError, EmptyDataError, ValueError) as pe: raise HTTPException(status_code=400, detail=f"Could not parse {data_format.upper()} data: {str(pe)}")
     except HTTPException as http_err: raise http_err
     except Exception as e:
@@ -379,11 +566,12 @@ async def import_database_table(
         except duckdb.Error:
             raise HTTPException(status_code=404, detail=f"Table '{table_name}' not found in the database file.")
 
-        # Fetch data as Pandas DataFrame
-        imported_df = con.execute(f"SELECT * FROM {s_table_name};").fetchdf()
+        # Fetch data as an Arrow table (stored as-is, no pandas round-trip)
+        imported_table = con.execute(f"SELECT * FROM {s_table_name};").arrow()
 
-        # Determine type and serialize to CSV bytes
-        data_type, content_bytes = _determine_type_and_content(imported_df)
+        # Determine type and serialize to Arrow IPC
+        data_type, content_bytes = _determine_type_and_content(imported_table)
+        metadata = _content_metadata(imported_table)
         if data_type == "series":
              print(f"Imported table '{table_name}' has one column, treating '{new_dataset_name}' as Series type.")
 
@@ -393,15 +581,16 @@ async def import_database_table(
             "type": data_type,
             "origin": "db",
             "original_filename": f"{new_dataset_name}_from_{table_name}.csv",
-            "history": []
+            "history": [],
+            **metadata
         }
 
-        preview_info = _get_preview_from_content(content_bytes, data_type, limit=100)
+        preview_info = _get_preview_from_content(content_bytes, data_type, limit=100, metadata=metadata)
 
         # Clean up the temp DB file associated with this import ID? Maybe not yet, user might import another table.
         # Consider adding a separate cleanup mechanism or timeout for temp_db_files.
 
-        return {
+        return ORJSONResponse({
             "message": f"Successfully imported table '{table_name}' as dataset '{new_dataset_name}' ({data_type})",
             "dataset_name": new_dataset_name,
             "dataset_type": data_type,
@@ -409,7 +598,7 @@ async def import_database_table(
             "columns": preview_info.get("columns", []),
             "row_count": preview_info.get("row_count", 0),
             "datasets": sorted(list(datasets_state.keys())) # Return all names
-        }
+        })
     except HTTPException as http_err: raise http_err
     except (duckdb.Error, ValueError) as db_err: raise HTTPException(status_code=500, detail=f"Error importing table '{table_name}': {db_err}")
     except Exception as e:
@@ -444,13 +633,17 @@ async def get_dataset_view(
         state_entry = datasets_state[dataset_name]
         content = state_entry["content"]
         data_type = state_entry["type"]
-        preview_info = _get_preview_from_content(content, data_type, limit, offset)
+        metadata = _cached_metadata(state_entry)
+        preview_info = _get_preview_from_content(content, data_type, limit, offset, metadata=metadata)
+        if metadata is None and "error" not in preview_info and state_entry["content"] is content:
+            # Entry predates the metadata cache: fill it from this full parse (unless an operation replaced the content meanwhile)
+            state_entry["columns"], state_entry["row_count"] = preview_info["columns"], preview_info["row_count"]
 
-        can_undo = bool(state_entry.get("history"))
+        can_undo = _can_undo(dataset_name)
         # Can reset if it has history (simplification: reset clears history)
         can_reset = can_undo
 
-        return {
+        return ORJSONResponse({
             "dataset_name": dataset_name,
             "dataset_type": data_type,
             "data": preview_info.get("data", []),
@@ -459,7 +652,7 @@ async def get_dataset_view(
             "can_undo": can_undo,
             "can_reset": can_reset,
             # No last_code needed here, frontend manages editor state
-        }
+        })
     except Exception as e:
         print(f"Error in get_dataset_view for '{dataset_name}': {type(e).__name__}: {e}")
         traceback.print_exc()
@@ -469,57 +662,113 @@ async def get_dataset_view(
 @app.get("/dataset-info/{dataset_name}")
 async def get_dataset_info(dataset_name: str):
     """Gets general information about a dataset (DataFrame or Series)."""
+    return await _run_in_cpu_pool(_get_dataset_info, dataset_name)
+
+def _duckdb_column_profile(table: pa.Table, count_unique: bool, top_values_below: int) -> Dict[str, Dict[str, Any]]:
+    """
+    Per-column "missing" counts (and "unique" counts, plus "top_values" for columns with fewer distinct
+    values than top_values_below) computed by DuckDB: one aggregate query over all columns, then one
+    GROUPING SETS query that counts the values of all low-cardinality columns in a single scan.
+    Float NaN counts as missing, as with pandas isnull/nunique.
+    """
+    con = _open_duckdb_cursor()
+    try:
+        con.register("profile_source", table)
+        quoted = ['"' + col.replace('"', '""') + '"' for col in table.column_names]
+        select_list = [
+            f"CASE WHEN isnan({q}) THEN NULL ELSE {q} END AS {q}" if pa.types.is_floating(field.type) else q
+            for q, field in zip(quoted, table.schema)
+        ]
+        con.execute(f"CREATE VIEW profile_data AS SELECT {', '.join(select_list)} FROM profile_source;") # In the request's scratch schema
+        aggregates = [f"count({q})" for q in quoted]
+        if count_unique:
+            aggregates += [f"count(DISTINCT {q})" for q in quoted]
+        counts = con.execute(f"SELECT {', '.join(aggregates)} FROM profile_data").fetchone()
+
+        profile = {}
+        n_cols = len(quoted)
+        low_cardinality = []
+        for i, (col, q) in enumerate(zip(table.column_names, quoted)):
+            profile[col] = {"missing": table.num_rows - counts[i]}
+            if count_unique:
+                profile[col]["unique"] = counts[n_cols + i]
+                if profile[col]["unique"] < top_values_below:
+                    profile[col]["top_values"] = {}
+                    low_cardinality.append((col, q))
+
+        for start in range(0, len(low_cardinality), PROFILE_GROUPING_SET_COLUMNS):
+            batch = low_cardinality[start:start + PROFILE_GROUPING_SET_COLUMNS]
+            batch_quoted = ", ".join(q for _, q in batch)
+            grouping_sets = ", ".join(f"({q})" for _, q in batch)
+            rows = con.execute(
+                f"SELECT {batch_quoted}, GROUPING({batch_quoted}) AS gid, count(*) AS n FROM profile_data "
+                f"GROUP BY GROUPING SETS ({grouping_sets}) ORDER BY gid, n DESC, {batch_quoted}"
+            ).fetchall()
+            # GROUPING() sets a bit for every column not grouped in the row's set; the first column is the high bit
+            all_bits = (1 << len(batch)) - 1
+            column_by_gid = {all_bits ^ (1 << (len(batch) - 1 - j)): j for j in range(len(batch))}
+            for row in rows:
+                j = column_by_gid[row[-2]]
+                value, top_values = row[j], profile[batch[j][0]]["top_values"]
+                if value is not None and len(top_values) < 10: # Rows come sorted by count, so the first 10 are the top 10
+                    top_values[str(value)] = int(row[-1]) # Keys as strings, like the pandas path
+        return profile
+    finally:
+        _close_duckdb_cursor(con)
+
+def _get_dataset_info(dataset_name: str):
+    """Blocking implementation of /dataset-info (runs in cpu_pool)."""
     if dataset_name not in datasets_state:
         raise HTTPException(status_code=404, detail=f"Dataset '{dataset_name}' not found.")
     try:
         state_entry = datasets_state[dataset_name]
         content = state_entry["content"]
         data_type = state_entry["type"]
+        metadata = _cached_metadata(state_entry)
 
-        # Use pandas to calculate info from the current CSV content
-        df = pd.read_csv(io.BytesIO(content)) # Read as DataFrame regardless of type for now
-        total_rows = len(df)
-        column_count = len(df.columns)
+        if metadata is not None and metadata["row_count"] == 0:
+            table = None # Nothing to summarize; answer from the cached metadata without parsing
+            total_rows, column_count = 0, len(metadata["columns"])
+        else:
+            table = storage_service.read_arrow(content) # Cached Arrow table; DuckDB scans it without a pandas copy
+            total_rows = table.num_rows
+            column_count = table.num_columns
 
-        if df.empty:
-            return {
+        if table is None or total_rows == 0 or column_count == 0:
+            return ORJSONResponse({
                 "dataset_name": dataset_name, "dataset_type": data_type,
                 "row_count": 0, "column_count": column_count, "memory_usage_bytes": 0,
                 "column_types": {}, "numeric_columns": [], "categorical_columns": [],
                 "datetime_columns": [], "other_columns": [], "missing_values_count": {},
                 "missing_values_percentage": {}, "unique_value_summary": {}
-            }
+            })
 
         # --- DataFrame Specific Info ---
-        numeric_cols = df.select_dtypes(include=np.number).columns.tolist()
-        categorical_cols = df.select_dtypes(include=['object', 'category']).columns.tolist()
-        datetime_cols = df.select_dtypes(include=['datetime', 'datetimetz']).columns.tolist()
-        other_cols = df.select_dtypes(exclude=[np.number, 'object', 'category', 'datetime', 'datetimetz']).columns.tolist()
-        column_types = {col: str(df[col].dtype) for col in df.columns}
-        missing_values = df.isnull().sum().to_dict()
-        missing_percent = {k: round((v / total_rows * 100), 2) if total_rows > 0 else 0 for k, v in missing_values.items()}
+        # Classify on an empty frame with the same (Arrow-backed) dtypes read_pandas would give
+        dtypes_df = table.schema.empty_table().to_pandas(types_mapper=pd.ArrowDtype)
+        numeric_cols = dtypes_df.select_dtypes(include=np.number).columns.tolist()
+        categorical_cols = dtypes_df.select_dtypes(include=['object', 'category', 'string']).columns.tolist() # 'string' covers Arrow-backed text
+        datetime_cols = dtypes_df.select_dtypes(include=['datetime', 'datetimetz']).columns.tolist()
+        other_cols = dtypes_df.select_dtypes(exclude=[np.number, 'object', 'category', 'string', 'datetime', 'datetimetz']).columns.tolist()
+        column_types = {col: str(dtype) for col, dtype in dtypes_df.dtypes.items()}
 
         # Unique value summary (only for DataFrames or if Series treated as DF)
+        count_unique = total_rows < 50000 # Limit unique check for performance
+        profile = _duckdb_column_profile(table, count_unique=count_unique, top_values_below=100) # Show top 10 values if cardinality is low
+        missing_values = {col: col_profile["missing"] for col, col_profile in profile.items()}
+        missing_percent = {k: round((v / total_rows * 100), 2) if total_rows > 0 else 0 for k, v in missing_values.items()}
         unique_counts = {}
-        if data_type == "dataframe": # Only compute detailed unique for dataframes for now
-            for col in df.columns:
-                if total_rows > 0 and total_rows < 50000: # Limit unique check for performance
-                    try:
-                        nunique = df[col].nunique()
-                        unique_counts[col] = {"total_unique": nunique}
-                        if nunique < 100: # Show top 10 values if cardinality is low
-                            value_counts = df[col].value_counts().head(10).to_dict()
-                            # Ensure keys/values are JSON serializable
-                            unique_counts[col]["values"] = {str(k): int(v) if isinstance(v, (np.integer, np.int64)) else v for k, v in value_counts.items()}
-                    except Exception as unique_err:
-                        print(f"Could not calculate unique counts for column '{col}': {unique_err}")
-                        unique_counts[col] = {"error": "Could not calculate"}
+        if count_unique:
+            for col, col_profile in profile.items():
+                unique_counts[col] = {"total_unique": col_profile["unique"]}
+                if "top_values" in col_profile:
+                    unique_counts[col]["values"] = col_profile["top_values"]
 
         # --- Base Info ---
         info = {
             "dataset_name": dataset_name, "dataset_type": data_type,
             "row_count": total_rows, "column_count": column_count,
-            "memory_usage_bytes": int(df.memory_usage(deep=True).sum()),
+            "memory_usage_bytes": int(table.nbytes),
             "column_types": column_types,
             "missing_values_count": missing_values,
             "missing_values_percentage": missing_percent,
@@ -536,7 +785,7 @@ async def get_dataset_info(dataset_name: str):
             })
         # If it's a Series, some fields might be simplified or omitted
         elif data_type == "series" and column_count == 1:
-             series_col_name = df.columns[0]
+             series_col_name = table.column_names[0]
              info["series_name"] = series_col_name # Add series name if identifiable
              # Simplify some fields for series view
              info["numeric_columns"] = numeric_cols
@@ -544,21 +793,11 @@ async def get_dataset_info(dataset_name: str):
              info["datetime_columns"] = datetime_cols
              info["other_columns"] = other_cols
              # Unique summary for the series itself
-             if total_rows > 0 and total_rows < 50000:
-                 try:
-                     series_col = df[series_col_name]
-                     nunique = series_col.nunique()
-                     unique_counts[series_col_name] = {"total_unique": nunique}
-                     if nunique < 100:
-                         value_counts = series_col.value_counts().head(10).to_dict()
-                         unique_counts[series_col_name]["values"] = {str(k): int(v) if isinstance(v, (np.integer, np.int64)) else v for k, v in value_counts.items()}
-                     info["unique_value_summary"] = unique_counts
-                 except Exception as unique_err:
-                     print(f"Could not calculate unique counts for series '{series_col_name}': {unique_err}")
-                     info["unique_value_summary"] = {series_col_name: {"error": "Could not calculate"}}
+             if count_unique:
+                 info["unique_value_summary"] = unique_counts
 
 
-        return info
+        return ORJSONResponse(info) # Encoded here in the worker, not by FastAPI's jsonable_encoder walk
 
     except (ParserError, EmptyDataError) as pe: raise HTTPException(status_code=400, detail=f"Cannot get info: Invalid data format for '{dataset_name}'. {str(pe)}")
     except Exception as e_inner:
@@ -570,6 +809,10 @@ async def get_dataset_info(dataset_name: str):
 @app.get("/column-stats/{dataset_name}/{column_name}")
 async def get_column_stats(dataset_name: str, column_name: str):
     """Gets detailed statistics for a specific column within a dataset."""
+    return await _run_in_cpu_pool(_get_column_stats, dataset_name, column_name)
+
+def _get_column_stats(dataset_name: str, column_name: str):
+    """Blocking implementation of /column-stats (runs in cpu_pool)."""
     if dataset_name not in datasets_state:
         raise HTTPException(status_code=404, detail=f"Dataset '{dataset_name}' not found.")
     try:
@@ -577,47 +820,61 @@ async def get_column_stats(dataset_name: str, column_name: str):
         content = state_entry["content"]
         data_type = state_entry["type"] # Needed? Column stats are column stats.
 
-        # Use pandas for stats calculation
-        df = pd.read_csv(io.BytesIO(content))
-        if column_name not in df.columns:
+        # Only the requested column is converted to pandas; the rest stays in the cached Arrow table
+        table = storage_service.read_arrow(content)
+        if column_name not in table.column_names:
             raise HTTPException(status_code=404, detail=f"Column '{column_name}' not found in dataset '{dataset_name}'.")
 
-        column_data = df[column_name].copy()
-        total_rows = len(df)
+        arrow_column = table.column(column_name)
+        column_data = arrow_column.to_pandas(types_mapper=pd.ArrowDtype) # Read-only below, no copy needed
+        total_rows = table.num_rows
+        # Arrow keeps the null count with the validity bitmap, so no boolean mask is built; float NaN counts as missing like isnull()
+        missing_count = arrow_column.null_count
+        if pa.types.is_floating(arrow_column.type):
+            missing_count += pc.sum(pc.is_nan(arrow_column)).as_py() or 0
+        all_missing = missing_count == total_rows # Checked once, reused by the type-specific stats
         stats = {
             "column_name": column_name,
             "dataset_name": dataset_name,
             "dtype": str(column_data.dtype),
-            "missing_count": int(column_data.isnull().sum()),
-            "missing_percentage": round((column_data.isnull().sum() / total_rows * 100), 2) if total_rows > 0 else 0,
+            "missing_count": missing_count,
+            "missing_percentage": round((missing_count / total_rows * 100), 2) if total_rows > 0 else 0,
             "memory_usage_bytes": int(column_data.memory_usage(deep=True))
         }
 
         # Calculate type-specific stats
         if pd.api.types.is_numeric_dtype(column_data.dtype):
-            desc = column_data.describe()
+            # All reductions in one polars select (run in parallel) instead of pandas describe's separate passes
+            values = pl.from_arrow(arrow_column).cast(pl.Float64).fill_nan(None).alias("v") # NaN is missing, as for pandas
+            col = pl.col("v")
+            mean, std, min_val, max_val, q25, q50, q75 = values.to_frame().select(
+                col.mean().alias("mean"), col.std().alias("std"), col.min().alias("min"), col.max().alias("max"),
+                col.quantile(0.25, interpolation="linear").alias("q25"), # Same interpolation as pandas
+                col.quantile(0.5, interpolation="linear").alias("q50"),
+                col.quantile(0.75, interpolation="linear").alias("q75"),
+            ).row(0)
             stats.update({
-                "mean": float(desc['mean']) if pd.notna(desc.get('mean')) else None,
-                "std": float(desc['std']) if pd.notna(desc.get('std')) else None,
-                "min": float(desc['min']) if pd.notna(desc.get('min')) else None,
-                "max": float(desc['max']) if pd.notna(desc.get('max')) else None,
-                "quantiles": {
-                    "25%": float(desc['25%']) if pd.notna(desc.get('25%')) else None,
-                    "50%": float(desc['50%']) if pd.notna(desc.get('50%')) else None, # Median
-                    "75%": float(desc['75%']) if pd.notna(desc.get('75%')) else None,
-                }
+                "mean": mean, "std": std, "min": min_val, "max": max_val,
+                "quantiles": {"25%": q25, "50%": q50, "75%": q75} # 50% is the median
             })
+            finite_values = values.filter(values.is_finite()).to_numpy() # Nulls/inf dropped, contiguous float64
+            if finite_values.size > 0:
+                counts, bin_edges = np.histogram(finite_values, bins=HISTOGRAM_BINS) # One vectorized pass
+                # The stats panel labels each bar with its lower edge (one label per bar)
+                stats["histogram"] = {"counts": counts.tolist(), "bin_edges": bin_edges[:-1].tolist()}
         elif pd.api.types.is_datetime64_any_dtype(column_data.dtype):
             stats.update({
-                "min_date": str(column_data.min()) if not column_data.isnull().all() else None,
-                "max_date": str(column_data.max()) if not column_data.isnull().all() else None,
+                "min_date": str(column_data.min()) if not all_missing else None,
+                "max_date": str(column_data.max()) if not all_missing else None,
             })
         else: # Assume categorical/object/other
-            nunique = column_data.nunique()
+            values = pl.from_arrow(arrow_column).drop_nulls() # Missing values are not counted, as in pandas
+            nunique = values.n_unique()
             stats["unique_count"] = int(nunique)
             if nunique < 1000 and total_rows > 0: # Only show top values if cardinality is reasonable
-                top_values = column_data.value_counts().head(10).to_dict()
-                stats["top_values"] = {str(k): int(v) for k, v in top_values.items()} # Ensure keys are strings, values are ints
+                top_values = values.value_counts(sort=True).head(10) # Two columns: the values and "count"
+                # Converted column-wise (two list conversions), not one dict per row
+                stats["top_values"] = {str(k): int(v) for k, v in zip(top_values.to_series(0).to_list(), top_values["count"].to_list())} # Ensure keys are strings, values are ints
 
         # Convert numpy types before returning for JSON serialization
         for key, value in stats.items():
@@ -627,7 +884,7 @@ async def get_column_stats(dataset_name: str, column_name: str):
             elif isinstance(value, dict): # Handle quantiles and top_values
                 stats[key] = {str(k): (int(v) if isinstance(v, (np.integer, np.int64)) else float(v) if isinstance(v, (np.floating, np.float64)) and pd.notna(v) else None if isinstance(v, (np.floating, np.float64)) else v) for k, v in value.items()}
 
-        return stats
+        return ORJSONResponse(stats) # Encoded here in the worker, not by FastAPI's jsonable_encoder walk
     except (ParserError, EmptyDataError) as pe: raise HTTPException(status_code=400, detail=f"Cannot get stats: Invalid data format for '{dataset_name}'. {str(pe)}")
     except KeyError: raise HTTPException(status_code=404, detail=f"Column '{column_name}' not found in dataset '{dataset_name}'.")
     except Exception as e_inner:
@@ -646,6 +903,10 @@ async def execute_custom_code(
     current_view_name: Optional[str] = Form(None)
 ):
     """Executes custom code (Pandas, Polars, SQL), potentially creating/modifying multiple datasets."""
+    return await _run_in_cpu_pool(_execute_custom_code, code, engine, current_view_name)
+
+def _execute_custom_code(code: str, engine: str, current_view_name: Optional[str]):
+    """Blocking implementation of /execute-code (runs in cpu_pool)."""
     if not code.strip():
         raise HTTPException(status_code=400, detail="Code cannot be empty.")
 
@@ -669,7 +930,7 @@ async def execute_custom_code(
                 try:
                     # Load based on stored type
                     df_or_series: Union[pd.DataFrame, pd.Series]
-                    df_temp = pd.read_csv(io.BytesIO(state["content"]))
+                    df_temp = storage_service.read_pandas(state["content"])
                     if state["type"] == "series" and len(df_temp.columns) == 1:
                         df_or_series = df_temp.iloc[:, 0] # Convert back to Series
                         df_or_series.name = df_temp.columns[0] # Preserve name
@@ -691,7 +952,7 @@ async def execute_custom_code(
                     # TODO: Add Polars Series handling if needed.
                     if state["type"] == "series":
                          print(f"Warning: Polars execution currently loads Series '{name}' as a single-column DataFrame '{var_name}'.")
-                    df = pl.read_csv(state["content"]) # Polars reads bytes
+                    df = storage_service.read_polars(state["content"])
                     local_vars[var_name] = df
                     print(f"Loaded '{name}' ({state['type']}) as polars var '{var_name}'")
                 except Exception as load_err:
@@ -700,24 +961,21 @@ async def execute_custom_code(
 
         elif engine == "sql":
             # SQL execution uses DuckDB connection
-            con = duckdb.connect(":memory:")
+            con = _open_duckdb_cursor()
             # Load all datasets as tables (use original name)
             loaded_tables = set() # Keep track of successfully loaded tables
             for name, state in datasets_state.items():
                 # Use original dataset name directly as table name
                 table_name = name
                 try:
-                    # Load content into DuckDB table using pandas for robustness
-                    df_for_sql = pd.read_csv(io.BytesIO(state["content"]))
-                    con.register(table_name, df_for_sql)
-                    print(f"Loaded '{name}' ({state['type']}) as SQL table '{table_name}'")
+                    sql_service._load_data_to_duckdb(con, table_name, state["content"]) # In-memory Arrow registration, no re-parse
                     loaded_tables.add(table_name)
                 except Exception as load_err:
                     print(f"Warning: Failed to load dataset '{name}' for SQL execution: {load_err}")
             # Globals not used directly for SQL execution string
 
             # --- Execute Code ---
-            final_result_df = None
+            final_result_table = None
             try:
                 # Execute the whole block. DuckDB handles multiple statements separated by ;
                 # Use sql() which can return results for the last statement
@@ -726,11 +984,11 @@ async def execute_custom_code(
                 # Check if the last statement returned results (likely a SELECT)
                 if query_result:
                     try:
-                        final_result_df = query_result.fetchdf()
-                        print(f"SQL code execution resulted in a DataFrame with {len(final_result_df)} rows.")
+                        final_result_table = query_result.arrow()
+                        print(f"SQL code execution resulted in a table with {final_result_table.num_rows} rows.")
                     except Exception as fetch_err:
                         print(f"Warning: Could not fetch DataFrame from SQL query result: {fetch_err}")
-                        final_result_df = None # Reset if fetch fails
+                        final_result_table = None # Reset if fetch fails
 
                 # --- Infer created/modified tables ---
                 # Check for CREATE TABLE statements first (explicit modification)
@@ -747,7 +1005,7 @@ async def execute_custom_code(
                     print(f"SQL detected CREATE TABLE: {created_table_name}")
 
                 # --- Handle SELECT results updating state (if no CREATE TABLE) ---
-                if not create_table_matches and final_result_df is not None and not final_result_df.empty:
+                if not create_table_matches and final_result_table is not None and final_result_table.num_rows > 0:
                     print("Attempting to update state from SELECT result...")
                     # Try to determine which original table was primarily queried
                     # Simple approach: check FROM clause of the *last* statement for known tables
@@ -760,7 +1018,7 @@ async def execute_custom_code(
                             print(f"SELECT result seems related to current view '{current_view_name}'. Updating its state.")
                             modified_or_created_datasets.add(current_view_name)
                             primary_result_name = current_view_name
-                            # The content will be updated below using final_result_df
+                            # The content will be updated below using final_result_table
                         else:
                             print(f"SELECT result detected, but current view '{current_view_name}' not found in FROM clause (basic check). Not updating state.")
                             # Keep primary_result_name as current_view_name for preview return, but don't modify state
@@ -778,40 +1036,42 @@ async def execute_custom_code(
 
 
             except duckdb.Error as sql_err:
-                if con: con.close()
+                if con: _close_duckdb_cursor(con)
                 raise sql_err # Re-raise to be caught by outer handler
 
             # --- Update State from Execution Results ---
             # Update based on CREATE TABLE or inferred SELECT target
             for dataset_key_name in modified_or_created_datasets:
                 try:
-                    df_to_save = None
+                    table_to_save = None
                     # If it was the target of the SELECT result
-                    if dataset_key_name == primary_result_name and final_result_df is not None:
-                        df_to_save = final_result_df
+                    if dataset_key_name == primary_result_name and final_result_table is not None:
+                        table_to_save = final_result_table
                         print(f"Using SELECT result DataFrame for '{dataset_key_name}'.")
                     else:
                         # Otherwise, fetch content from the table (must exist if created)
                         print(f"Fetching content from table '{dataset_key_name}' (likely from CREATE TABLE).")
                         # Use the raw name for fetching from DuckDB table
-                        df_to_save = con.execute(f"SELECT * FROM {dataset_key_name}").fetchdf()
-
-                    if df_to_save is not None:
-                        new_type, new_content = _determine_type_and_content(df_to_save) # Determine type
-
-                        history = datasets_state.get(dataset_key_name, {}).get("history", [])
-                        if dataset_key_name in datasets_state: # If overwriting
-                            history.append(datasets_state[dataset_key_name]["content"])
-                            history = history[-5:]
-
-                        datasets_state[dataset_key_name] = {
-                            "content": new_content,
-                            "type": new_type,
-                            "origin": "code", # Mark as code-generated/modified
-                            "original_filename": None, # No original file
-                            "history": history,
-                            "sql_chain": None # *** CRITICAL: Clear SQL chain after custom code modification ***
-                        }
+                        table_to_save = con.execute(f"SELECT * FROM {dataset_key_name}").arrow()
+
+                    if table_to_save is not None:
+                        new_type, new_content = _determine_type_and_content(table_to_save) # Determine type
+
+                        with _dataset_lock(dataset_key_name): # History and content of this dataset change together
+                            history = datasets_state.get(dataset_key_name, {}).get("history", [])
+                            if dataset_key_name in datasets_state: # If overwriting
+                                history.append(datasets_state[dataset_key_name]["content"])
+                                history = history[-5:]
+
+                            datasets_state[dataset_key_name] = {
+                                "content": new_content,
+                                "type": new_type,
+                                "origin": "code", # Mark as code-generated/modified
+                                "original_filename": None, # No original file
+                                "history": history,
+                                "sql_chain": None, # *** CRITICAL: Clear SQL chain after custom code modification ***
+                                **_content_metadata(table_to_save)
+                            }
                         print(f"Updated state for dataset: '{dataset_key_name}' ({new_type}). Cleared SQL chain.")
 
                         # Update primary result info if this was the one identified
@@ -823,7 +1083,7 @@ async def execute_custom_code(
 
                 except Exception as sql_update_err:
                     print(f"Error fetching/updating state for SQL dataset '{dataset_key_name}': {sql_update_err}")
-            if con: con.close() # Close connection after processing
+            if con: _close_duckdb_cursor(con) # Close connection after processing
 
             # --- Prepare Response ---
             final_datasets_list = sorted(list(datasets_state.keys()))
@@ -834,32 +1094,29 @@ async def execute_custom_code(
 
             if target_preview_name and target_preview_name in datasets_state:
                 state_entry = datasets_state[target_preview_name]
-                response_preview = _get_preview_from_content(state_entry["content"], state_entry["type"], limit=100)
+                response_preview = _get_preview_from_content(state_entry["content"], state_entry["type"], limit=100, metadata=_cached_metadata(state_entry))
                 # If SELECT result was shown but didn't update state, use its preview
-                if target_preview_name == current_view_name and primary_result_name is None and final_result_df is not None:
+                if target_preview_name == current_view_name and primary_result_name is None and final_result_table is not None:
                     print(f"Returning preview of SELECT result directly (state not updated).")
-                    temp_type, temp_content = _determine_type_and_content(final_result_df)
+                    temp_type, temp_content = _determine_type_and_content(final_result_table)
                     response_preview = _get_preview_from_content(temp_content, temp_type, limit=100)
                     # Don't report undo/reset status for this temporary preview
                     response_preview["can_undo"] = False
                     response_preview["can_reset"] = False
 
 
-            elif final_result_df is not None: # Fallback: preview the SELECT result if nothing else matches
+            elif final_result_table is not None: # Fallback: preview the SELECT result if nothing else matches
                 print("Returning preview of SELECT result as fallback.")
-                temp_type, temp_content = _determine_type_and_content(final_result_df)
+                temp_type, temp_content = _determine_type_and_content(final_result_table)
                 response_preview = _get_preview_from_content(temp_content, temp_type, limit=100)
                 target_preview_name = "[SELECT Result]" # Indicate it's not a saved dataset
 
 
             # Get undo/reset status for the dataset whose preview is being returned
-            can_undo = False
-            can_reset = False
-            if target_preview_name and target_preview_name in datasets_state:
-                can_undo = bool(datasets_state[target_preview_name].get("history"))
-                can_reset = bool(datasets_state[target_preview_name].get("history")) # Reset clears history
+            can_undo = _can_undo(target_preview_name) if target_preview_name else False
+            can_reset = can_undo # Reset clears history
 
-            return {
+            return ORJSONResponse({
                 "message": f"SQL code executed. Updated/Created: {', '.join(sorted(list(modified_or_created_datasets))) if modified_or_created_datasets else 'None'}.",
                 "datasets": final_datasets_list,
                 "primary_result_name": target_preview_name, # Hint to frontend which preview is returned
@@ -869,31 +1126,21 @@ async def execute_custom_code(
                 "row_count": response_preview.get("row_count", 0),
                 "can_undo": can_undo,
                 "can_reset": can_reset,
-            }
+            })
 
         # --- Identify Assignment Targets (for Pandas/Polars) ---
         assigned_vars = set()
         if engine in ["pandas", "polars"]:
-            try:
-                tree = ast.parse(code)
-                for node in ast.walk(tree):
-                    if isinstance(node, ast.Assign):
-                        for target in node.targets:
-                            if isinstance(target, ast.Name):
-                                assigned_vars.add(target.id)
-                    # Handle assignments via attribute (e.g., df['new_col'] = ...) - harder to track perfectly
-                    # elif isinstance(node, ast.Assign):
-                    #     if isinstance(node.targets[0], ast.Subscript) and isinstance(node.targets[0].value, ast.Name):
-                    #         # This detects df['col'] = ..., potentially modifying existing df
-                    #         assigned_vars.add(node.targets[0].value.id) # Mark the base df as potentially modified
-            except SyntaxError:
-                pass # Let exec handle the syntax error reporting
+            # Parsed once per distinct snippet; a SyntaxError is reported like any execution error
+            # Handle assignments via attribute (e.g., df['new_col'] = ...) - harder to track perfectly
+            code_obj, assigned_names = _compile_user_code(code)
+            assigned_vars = set(assigned_names)
             print(f"Identified potential assignment targets: {assigned_vars}")
 
 
         # --- Execute Code ---
         if engine in ["pandas", "polars"]:
-            exec(code, exec_globals, local_vars)
+            exec(code_obj, exec_globals, local_vars) # Precompiled, see _compile_user_code
         elif engine == "sql":
             try:
                 # Execute the whole block. DuckDB handles multiple statements separated by ;
@@ -913,7 +1160,7 @@ async def execute_custom_code(
                 # If no CREATE TABLE, maybe the last SELECT result is the primary? Hard to tell.
 
             except duckdb.Error as sql_err:
-                 if con: con.close()
+                 if con: _close_duckdb_cursor(con)
                  raise sql_err # Re-raise to be caught by outer handler
 
         # --- Update State from Execution Results ---
@@ -940,16 +1187,14 @@ async def execute_custom_code(
                         print(f"Found modified/new {type(value).__name__}: '{var_name}' (maps to key: '{dataset_key_name}')")
 
                         # Serialize back to CSV bytes and determine type
-                        new_content: Optional[bytes] = None
+                        new_content: Optional[storage_service.Content] = None
                         new_type: Optional[str] = None
                         try:
                             if engine == "pandas":
                                 new_type, new_content = _determine_type_and_content(value)
                             elif engine == "polars" and is_df: # Polars Series handling TBD
                                 new_type = "dataframe" # Assume DF for Polars for now
-                                with io.BytesIO() as buffer:
-                                    value.write_csv(buffer)
-                                    new_content = buffer.getvalue()
+                                new_content = storage_service.store_polars(value) # Arrow IPC, avoids CSV text round-trip
                             # Add Polars Series handling here if needed
                         except Exception as serialize_err:
                             print(f"Error serializing result for '{var_name}': {serialize_err}")
@@ -957,19 +1202,21 @@ async def execute_custom_code(
 
                         if new_content and new_type:
                             # Add previous state to history if updating existing
-                            history = datasets_state.get(dataset_key_name, {}).get("history", [])
-                            if dataset_key_name in datasets_state:
-                                history.append(datasets_state[dataset_key_name]["content"])
-                                history = history[-5:] # Limit history size
-
-                            # Update or add to main state
-                            datasets_state[dataset_key_name] = {
-                                "content": new_content,
-                                "type": new_type,
-                                "origin": "code", # Mark as code-generated/modified
-                                "original_filename": None, # No original file
-                                "history": history
-                            }
+                            with _dataset_lock(dataset_key_name): # History and content of this dataset change together
+                                history = datasets_state.get(dataset_key_name, {}).get("history", [])
+                                if dataset_key_name in datasets_state:
+                                    history.append(datasets_state[dataset_key_name]["content"])
+                                    history = history[-5:] # Limit history size
+
+                                # Update or add to main state
+                                datasets_state[dataset_key_name] = {
+                                    "content": new_content,
+                                    "type": new_type,
+                                    "origin": "code", # Mark as code-generated/modified
+                                    "original_filename": None, # No original file
+                                    "history": history,
+                                    **_content_metadata(value)
+                                }
                             modified_or_created_datasets.add(dataset_key_name)
 
                             # Update primary result if this matches the initial view or is the only result
@@ -988,21 +1235,23 @@ async def execute_custom_code(
             for table_name in modified_or_created_datasets:
                  try:
                      # Fetch content from the created table
-                     df = con.execute(f"SELECT * FROM {sql_service._sanitize_identifier(table_name)}").fetchdf()
-                     new_type, new_content = _determine_type_and_content(df) # Determine type
-
-                     history = datasets_state.get(table_name, {}).get("history", [])
-                     if table_name in datasets_state: # If overwriting via CREATE OR REPLACE
-                         history.append(datasets_state[table_name]["content"])
-                         history = history[-5:]
-
-                     datasets_state[table_name] = {
-                         "content": new_content,
-                         "type": new_type,
-                         "origin": "code", # Or 'sql'? Let's use 'code'
-                         "original_filename": None,
-                         "history": history
-                     }
+                     created_table = con.execute(f"SELECT * FROM {sql_service._sanitize_identifier(table_name)}").arrow()
+                     new_type, new_content = _determine_type_and_content(created_table) # Determine type
+
+                     with _dataset_lock(table_name): # History and content of this dataset change together
+                         history = datasets_state.get(table_name, {}).get("history", [])
+                         if table_name in datasets_state: # If overwriting via CREATE OR REPLACE
+                             history.append(datasets_state[table_name]["content"])
+                             history = history[-5:]
+
+                         datasets_state[table_name] = {
+                             "content": new_content,
+                             "type": new_type,
+                             "origin": "code", # Or 'sql'? Let's use 'code'
+                             "original_filename": None,
+                             "history": history,
+                             **_content_metadata(created_table)
+                         }
                      print(f"Updated state for SQL created table: '{table_name}' ({new_type})")
                      # Update primary result info if this was the one identified
                      if table_name == primary_result_name:
@@ -1011,7 +1260,7 @@ async def execute_custom_code(
 
                  except Exception as sql_update_err:
                      print(f"Error fetching/updating state for SQL table '{table_name}': {sql_update_err}")
-            if con: con.close() # Close connection after processing
+            if con: _close_duckdb_cursor(con) # Close connection after processing
 
         # --- Prepare Response ---
         final_datasets_list = sorted(list(datasets_state.keys()))
@@ -1026,10 +1275,10 @@ async def execute_custom_code(
             if first_result_name and first_result_name in datasets_state:
                  primary_result_name = first_result_name
                  state_entry = datasets_state[first_result_name]
-                 response_preview = _get_preview_from_content(state_entry["content"], state_entry["type"], limit=100)
+                 response_preview = _get_preview_from_content(state_entry["content"], state_entry["type"], limit=100, metadata=_cached_metadata(state_entry))
 
 
-        return {
+        return ORJSONResponse({
             "message": f"Code executed ({engine}). Updated/Created: {', '.join(sorted(list(modified_or_created_datasets))) if modified_or_created_datasets else 'None'}.",
             "datasets": final_datasets_list,
             "primary_result_name": primary_result_name, # Hint to frontend which preview is returned
@@ -1038,15 +1287,15 @@ async def execute_custom_code(
             "columns": response_preview.get("columns", []),
             "row_count": response_preview.get("row_count", 0),
             # Include undo/reset status for the primary result?
-            "can_undo": bool(datasets_state.get(primary_result_name, {}).get("history")),
-            "can_reset": bool(datasets_state.get(primary_result_name, {}).get("history")),
-        }
+            "can_undo": _can_undo(primary_result_name),
+            "can_reset": _can_undo(primary_result_name),
+        })
 
     except (SyntaxError, NameError, TypeError, ValueError, AttributeError, KeyError, IndexError,
-            pd.errors.PandasError, pl.exceptions.PolarsError if pl else Exception, duckdb.Error) as exec_err:
+            DataError, pl.exceptions.PolarsError if pl else Exception, duckdb.Error) as exec_err:
          traceback.print_exc()
          # Close SQL connection on error if it exists
-         if engine == "sql" and 'con' in locals() and con: con.close()
+         if engine == "sql" and 'con' in locals() and con: _close_duckdb_cursor(con)
          detail = f"Code execution failed ({engine}): {type(exec_err).__name__}: {str(exec_err)}"
          # Improve error message for NameError (suggesting dataset names)
          if isinstance(exec_err, NameError):
@@ -1054,12 +1303,12 @@ async def execute_custom_code(
              detail += f". Available dataset variables in context: {available_vars}"
          raise HTTPException(status_code=400, detail=detail)
     except HTTPException as http_err:
-         if engine == "sql" and 'con' in locals() and con: con.close()
+         if engine == "sql" and 'con' in locals() and con: _close_duckdb_cursor(con)
          raise http_err
     except Exception as e:
         print(f"Unexpected error in /execute-code: {type(e).__name__}: {e}")
         traceback.print_exc()
-        if engine == "sql" and 'con' in locals() and con: con.close()
+        if engine == "sql" and 'con' in locals() and con: _close_duckdb_cursor(con)
         raise HTTPException(status_code=500, detail=f"An unexpected error occurred during code execution.")
 
 
@@ -1076,8 +1325,8 @@ async def preview_relational_operation(
     """Previews a relational algebra operation using DuckDB."""
     con = None
     try:
-        params_dict = json.loads(params)
-        base_dataset_names = json.loads(base_dataset_names_json)
+        params_dict = orjson.loads(params)
+        base_dataset_names = orjson.loads(base_dataset_names_json)
         if not isinstance(base_dataset_names, list) or not base_dataset_names:
              raise HTTPException(status_code=400, detail="RA preview requires 'base_dataset_names_json' (list).")
 
@@ -1087,7 +1336,7 @@ async def preview_relational_operation(
         if primary_base_name not in datasets_state:
              raise HTTPException(status_code=404, detail=f"Base dataset '{primary_base_name}' not found.")
 
-        con = duckdb.connect(":memory:")
+        con = _open_duckdb_cursor()
 
         # Load ALL specified base datasets into the connection using their original names
         for name in base_dataset_names:
@@ -1100,6 +1349,7 @@ async def preview_relational_operation(
         # --- RA Preview Logic (largely same as before) ---
         source_sql_or_table: str
         columns_before: List[str] = []
+        needs_columns = operation.lower() == "rename"
         step_number = 0
 
         if current_sql_state:
@@ -1124,16 +1374,22 @@ async def preview_relational_operation(
             except duckdb.Error as view_err:
                 raise ValueError(f"Failed to create view from previous step SQL: {view_err}. SQL was: {core_previous_sql}")
 
-            cols_result = con.execute(f"DESCRIBE {temp_prev_view};").fetchall()
-            columns_before = [col[0] for col in cols_result]
+            if needs_columns: # Only rename needs the input columns; skip the DESCRIBE otherwise
+                cols_result = con.execute(f"DESCRIBE {temp_prev_view};").fetchall()
+                columns_before = [col[0] for col in cols_result]
             source_sql_or_table = temp_prev_view # The source for the *new* snippet is the view
 
         else:
             # No previous state, start from the primary base dataset
             step_number = 0
             s_primary_base_name = primary_base_name
-            cols_result = con.execute(f"DESCRIBE {s_primary_base_name};").fetchall()
-            columns_before = [col[0] for col in cols_result]
+            if needs_columns:
+                cached = _cached_metadata(datasets_state[primary_base_name]) # Same columns as the registered Arrow table
+                if cached is not None:
+                    columns_before = list(cached["columns"])
+                else:
+                    cols_result = con.execute(f"DESCRIBE {s_primary_base_name};").fetchall()
+                    columns_before = [col[0] for col in cols_result]
             source_sql_or_table = s_primary_base_name # Source is the base table itself
 
         # Handle operations needing column context (like rename)
@@ -1161,12 +1417,12 @@ async def preview_relational_operation(
         next_sql_state = f"({sql_snippet}) AS {s_current_step_alias}"
         print(f"DEBUG (RA Preview): Generated next_sql_state: {next_sql_state}")
 
-        return {
+        return ORJSONResponse({ # Row dicts go straight to orjson, skipping FastAPI's jsonable_encoder walk
             "message": "RA preview generated successfully.",
             "data": preview_data, "columns": result_columns, "row_count": total_rows,
             "generated_sql_state": next_sql_state,
             "current_step_sql_snippet": sql_snippet # The SQL for just this step
-        }
+        })
 
     except (ValueError, duckdb.Error, NotImplementedError, json.JSONDecodeError) as e:
          err_type = type(e).__name__
@@ -1184,7 +1440,7 @@ async def preview_relational_operation(
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Unexpected server error during RA preview.")
     finally:
-        if con: con.close()
+        if con: _close_duckdb_cursor(con)
 
 @app.post("/save-ra-result")
 async def save_relational_algebra_result(
@@ -1196,14 +1452,14 @@ async def save_relational_algebra_result(
     con = None
     try:
         if not new_dataset_name.strip(): raise ValueError("New dataset name cannot be empty.")
-        base_dataset_names = json.loads(base_dataset_names_json)
+        base_dataset_names = orjson.loads(base_dataset_names_json)
         if not isinstance(base_dataset_names, list) or not base_dataset_names:
             raise ValueError("Invalid or empty list of base dataset names provided.")
 
         if new_dataset_name in datasets_state:
             print(f"Warning: Overwriting dataset '{new_dataset_name}' with RA result save.")
 
-        con = duckdb.connect(":memory:")
+        con = _open_duckdb_cursor()
         # Load all necessary base datasets
         for ds_name in base_dataset_names:
              if ds_name not in datasets_state:
@@ -1213,12 +1469,10 @@ async def save_relational_algebra_result(
 
         print(f"Executing final RA SQL chain for saving '{new_dataset_name}':\n{final_sql_chain}")
         # Execute the final SQL chain provided by the frontend
-        full_df = con.execute(final_sql_chain).fetchdf()
+        full_table = con.execute(final_sql_chain).arrow()
 
-        # Determine type and serialize result to CSV bytes
-        data_type, new_content = _determine_type_and_content(full_df)
-        if data_type == "series":
-             print(f"RA result '{new_dataset_name}' has one column, saving as Series type.")
+        # RA results are always stored as tables (Arrow IPC, no pandas round-trip)
+        data_type, new_content = "dataframe", storage_service.store_arrow(full_table)
 
         # Save as a new entry in datasets_state
         datasets_state[new_dataset_name] = {
@@ -1226,11 +1480,12 @@ async def save_relational_algebra_result(
             "type": data_type,
             "origin": "ra",
             "original_filename": f"{new_dataset_name}_ra_result.csv",
-            "history": [] # RA results start with no history
+            "history": [], # RA results start with no history
+            **_content_metadata(full_table)
         }
 
-        saved_preview_info = _get_preview_from_content(new_content, data_type, limit=100)
-        return {
+        saved_preview_info = _get_preview_from_table(full_table, limit=100) # Slice the result still in memory; the stored content may be spilled
+        return ORJSONResponse({
             "message": f"Successfully saved RA result as '{new_dataset_name}' ({data_type}).",
             "dataset_name": new_dataset_name,
             "dataset_type": data_type,
@@ -1238,7 +1493,7 @@ async def save_relational_algebra_result(
             "columns": saved_preview_info.get("columns", []),
             "row_count": saved_preview_info.get("row_count", 0),
             "datasets": sorted(list(datasets_state.keys())) # Return updated list
-        }
+        })
     except (ValueError, duckdb.Error, json.JSONDecodeError) as e:
          detail = f"Failed to save RA result as '{new_dataset_name}': {str(e)}"
          print(f"RA Save Error (400): {detail}")
@@ -1249,7 +1504,7 @@ async def save_relational_algebra_result(
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Unexpected server error during RA save.")
     finally:
-        if con: con.close()
+        if con: _close_duckdb_cursor(con)
     
 @app.post("/apply-operation/{dataset_name}")
 async def apply_structured_operation(
@@ -1259,13 +1514,17 @@ async def apply_structured_operation(
     engine: str = Form(..., enum=["pandas", "sql", "polars"]) # Add polars to enum
 ):
     """Applies a structured operation (filter, groupby, sample etc.) using the specified engine."""
+    return await _run_in_cpu_pool(_with_dataset_lock, dataset_name, _apply_structured_operation, dataset_name, operation, params_json, engine)
+
+def _apply_structured_operation(dataset_name: str, operation: str, params_json: str, engine: str):
+    """Blocking implementation of /apply-operation (runs in cpu_pool)."""
     if dataset_name not in datasets_state:
         raise HTTPException(status_code=404, detail=f"Dataset '{dataset_name}' not found.")
 
     state_entry = datasets_state[dataset_name]
     params = {}
     try:
-        params = json.loads(params_json)
+        params = orjson.loads(params_json)
     except json.JSONDecodeError:
         raise HTTPException(status_code=400, detail="Invalid parameters JSON.")
 
@@ -1276,6 +1535,8 @@ async def apply_structured_operation(
     result_df = None # For Pandas/Polars
     generated_code = "" # For Pandas/Polars code snippet
     new_content = None # Holds resulting CSV bytes
+    new_metadata = None # Columns/row_count of the result, cached on the state entry
+    response_preview = None # Built from the in-memory result when there is one
 
     try:
         # --- Common logic for tracking history ---
@@ -1288,24 +1549,34 @@ async def apply_structured_operation(
                 print(f"Switching '{dataset_name}' from SQL to Pandas. Resetting SQL chain.")
                 state_entry["sql_chain"] = None
 
-            try: df = pd.read_csv(io.BytesIO(original_content))
-            except Exception as load_err: raise HTTPException(status_code=500, detail=f"Pandas: Failed to load current data: {load_err}")
-
-            if operation == 'merge':
-                # ... (keep merge logic as before) ...
-                right_dataset_name = params.get("right_dataset")
-                if not right_dataset_name or right_dataset_name not in datasets_state: raise HTTPException(status_code=404, detail=f"Pandas Merge: Right dataset '{right_dataset_name}' not found.")
-                try: right_df = pd.read_csv(io.BytesIO(datasets_state[right_dataset_name]["content"]))
-                except Exception as load_err: raise HTTPException(status_code=500, detail=f"Pandas Merge: Failed to load right dataset '{right_dataset_name}': {load_err}")
-                result_df, generated_code = pandas_service.apply_pandas_merge(df, right_df, params)
+            if operation.startswith('regex_') and params.get("regex") is not None:
+                # Validate before any data is loaded or shipped to a worker (fails fast on bad input)
+                flags = 0 if params.get("case_sensitive", True) else re.IGNORECASE
+                try: pandas_service._compile_regex(params["regex"], flags)
+                except re.error as regex_err: raise HTTPException(status_code=400, detail=f"Invalid regular expression: {regex_err}")
+
+            if operation == 'merge' or operation.startswith('regex_'):
+                # GIL-bound: run in a worker process on the serialized content, state stays here
+                right_content = None
+                if operation == 'merge':
+                    right_dataset_name = params.get("right_dataset")
+                    if not right_dataset_name or right_dataset_name not in datasets_state: raise HTTPException(status_code=404, detail=f"Pandas Merge: Right dataset '{right_dataset_name}' not found.")
+                    right_content = datasets_state[right_dataset_name]["content"] # Held here: a spill file must outlive the worker call
+                serialized, generated_code, new_metadata = process_pool.submit(
+                    pandas_service.apply_pandas_operation_to_content, storage_service.share_content(original_content), operation, params, storage_service.share_content(right_content)
+                ).result()
+                new_content = storage_service.open_shared(serialized, owned=True) # Takes over a spill file written by the worker
             else:
+                try: df = storage_service.read_pandas(original_content)
+                except Exception as load_err: raise HTTPException(status_code=500, detail=f"Pandas: Failed to load current data: {load_err}")
+
                 # Dispatch to the main pandas operation handler
                 result_df, generated_code = pandas_service.apply_pandas_operation(df, operation, params)
 
-            # Serialize result back to content
-            with io.BytesIO() as buffer:
-                result_df.to_csv(buffer, index=False)
-                new_content = buffer.getvalue()
+                # Serialize result back to content (Arrow IPC, no CSV text round-trip)
+                new_content = storage_service.store_pandas(result_df)
+                new_metadata = _content_metadata(result_df)
+                response_preview = _preview_from_df(result_df, new_content)
             state_entry["sql_chain"] = None # Clear SQL chain
 
         # --- POLARS ---
@@ -1314,14 +1585,14 @@ async def apply_structured_operation(
                 print(f"Switching '{dataset_name}' from SQL to Polars. Resetting SQL chain.")
                 state_entry["sql_chain"] = None
 
-            try: df = pl.read_csv(original_content) # Polars reads bytes
+            try: df = storage_service.read_polars(original_content)
             except Exception as load_err: raise HTTPException(status_code=500, detail=f"Polars: Failed to load current data: {load_err}")
 
             if operation == 'merge':
                  # ... (Polars join logic) ...
                 right_dataset_name = params.get("right_dataset")
                 if not right_dataset_name or right_dataset_name not in datasets_state: raise HTTPException(status_code=404, detail=f"Polars Join: Right dataset '{right_dataset_name}' not found.")
-                try: right_df = pl.read_csv(datasets_state[right_dataset_name]["content"])
+                try: right_df = storage_service.read_polars(datasets_state[right_dataset_name]["content"])
                 except Exception as load_err: raise HTTPException(status_code=500, detail=f"Polars Join: Failed to load right dataset '{right_dataset_name}': {load_err}")
                 # Assuming a polars_service.apply_polars_join exists similar to pandas
                 # Need to implement apply_polars_join if not already done
@@ -1333,19 +1604,19 @@ async def apply_structured_operation(
                 # Dispatch to the main polars operation handler
                 result_df, generated_code = polars_service.apply_polars_operation(df, operation, params)
 
-            # Serialize result back to content
-            with io.BytesIO() as buffer:
-                result_df.write_csv(buffer)
-                new_content = buffer.getvalue()
+            # Serialize result back to content (Arrow IPC, avoids CSV text round-trip)
+            new_content = storage_service.store_polars(result_df)
+            new_metadata = _content_metadata(result_df)
+            response_preview = _preview_from_df(result_df, new_content)
             state_entry["sql_chain"] = None # Clear SQL chain
 
         # --- SQL ---
         elif engine == "sql":
-            con = duckdb.connect(":memory:")
+            con = _open_duckdb_cursor()
             base_table_name = f"__{dataset_name}_base"
             base_table_ref = sql_service._sanitize_identifier(base_table_name)
 
-            try: sql_service._load_data_to_duckdb(con, base_table_name, original_content)
+            try: base_arrow = sql_service._load_data_to_duckdb(con, base_table_name, original_content)
             except Exception as load_err: raise HTTPException(status_code=500, detail=f"SQL: Failed to load current data into DuckDB: {load_err}")
 
             previous_sql_chain = state_entry.get("sql_chain")
@@ -1365,24 +1636,25 @@ async def apply_structured_operation(
                 if not right_dataset_name or right_dataset_name not in datasets_state: raise HTTPException(status_code=404, detail=f"SQL Join: Right dataset '{right_dataset_name}' not found.")
                 right_base_table_name = f"__{right_dataset_name}_base"
                 right_base_table_ref = sql_service._sanitize_identifier(right_base_table_name)
-                try: sql_service._load_data_to_duckdb(con, right_base_table_name, datasets_state[right_dataset_name]["content"])
+                try: right_arrow = sql_service._load_data_to_duckdb(con, right_base_table_name, datasets_state[right_dataset_name]["content"])
                 except Exception as load_err: raise HTTPException(status_code=500, detail=f"SQL Join: Failed to load right dataset '{right_dataset_name}': {load_err}")
-                preview_data, result_columns, total_rows, new_full_sql_chain, sql_snippet = sql_service.apply_sql_join(
-                    con=con, previous_sql_chain_left=previous_sql_chain, right_table_ref=right_base_table_ref, params=params, base_table_ref_left=base_table_ref
+                preview_data, result_columns, total_rows, new_full_sql_chain, sql_snippet, final_table = sql_service.apply_sql_join(
+                    con=con, previous_sql_chain_left=previous_sql_chain, right_table_ref=right_base_table_ref, params=params, base_table_ref_left=base_table_ref,
+                    materialize=True, tables={base_table_name: base_arrow, right_base_table_name: right_arrow}
                 )
             else:
                 # Dispatch to the main SQL operation handler
-                preview_data, result_columns, total_rows, new_full_sql_chain, sql_snippet = sql_service.apply_sql_operation(
-                    con=con, previous_sql_chain=previous_sql_chain, operation=operation, params=params, base_table_ref=base_table_ref
+                preview_data, result_columns, total_rows, new_full_sql_chain, sql_snippet, final_table = sql_service.apply_sql_operation(
+                    con=con, previous_sql_chain=previous_sql_chain, operation=operation, params=params, base_table_ref=base_table_ref,
+                    known_columns=state_entry.get("columns"), # Current content is the previous chain's result
+                    materialize=True # The full result is stored anyway; preview and row count come from it
                 )
 
-            # Materialize Result back to CSV content
+            # Materialize Result back to content (Arrow straight out of DuckDB)
             print(f"Materializing SQL result for '{dataset_name}'...")
             try:
-                final_df = con.execute(new_full_sql_chain).fetchdf()
-                with io.BytesIO() as buffer:
-                    final_df.to_csv(buffer, index=False)
-                    new_content = buffer.getvalue()
+                new_content = storage_service.store_arrow(final_table)
+                new_metadata = _content_metadata(final_table)
                 print(f"Materialization successful. Size: {len(new_content)} bytes.")
             except Exception as materialize_err: raise HTTPException(status_code=500, detail=f"SQL: Failed to materialize result: {materialize_err}")
 
@@ -1403,24 +1675,25 @@ async def apply_structured_operation(
                 "params_or_code": params, # Store params used
                 "generated_code_or_snippet": generated_code,
                 "previous_content": original_content, # Store previous content bytes
+                "previous_metadata": _cached_metadata(state_entry), # Cached columns/row_count of previous content
                 "previous_sql_chain": state_entry.get("sql_chain") if engine != "sql" else previous_sql_chain # Store chain before this step if switching away or continuing sql
             })
         state_entry["content"] = new_content
+        state_entry.update(new_metadata)
         state_entry["history"] = history[-10:] # Limit history size
 
         # --- Prepare Response ---
-        # For Pandas/Polars, generate preview from new_content. For SQL, use preview_data directly.
-        response_preview = {}
+        # SQL uses preview_data directly; Pandas/Polars use the in-memory result, or new_content if it was built in a worker.
         if engine == "sql":
             response_preview = {"data": preview_data, "columns": result_columns, "row_count": total_rows}
-        else:
-            response_preview = _get_preview_from_content(new_content, data_type='csv', limit=100)
+        elif response_preview is None:
+            response_preview = _get_preview_from_content(new_content, data_type='csv', limit=100, metadata=new_metadata)
 
-        can_undo = bool(state_entry.get("history"))
+        can_undo = _can_undo(dataset_name)
         # Reset currently means clear history, not revert to original upload.
-        can_reset = bool(state_entry.get("history"))
+        can_reset = can_undo
 
-        return {
+        return ORJSONResponse({
             "message": f"{engine.capitalize()} operation '{operation}' applied successfully to '{dataset_name}'.",
             "dataset_name": dataset_name,
             "data": response_preview.get("data", []),
@@ -1429,30 +1702,34 @@ async def apply_structured_operation(
             "can_undo": can_undo,
             "can_reset": can_reset,
             "generated_code": generated_code # Code snippet (Pandas/Polars) or CTE (SQL)
-        }
+        })
 
-    except (ValueError, pd.errors.PandasError, pl.exceptions.PolarsError if pl else Exception, duckdb.Error, KeyError, NotImplementedError) as op_err:
-        if con: con.close()
+    except (ValueError, DataError, pl.exceptions.PolarsError if pl else Exception, duckdb.Error, KeyError, NotImplementedError) as op_err:
+        if con: _close_duckdb_cursor(con)
         print(f"Operation Error ({engine}, {operation}): {type(op_err).__name__}: {op_err}")
         traceback.print_exc()
         raise HTTPException(status_code=400, detail=f"Operation failed: {str(op_err)}")
     except HTTPException as http_err:
-        if con: con.close()
+        if con: _close_duckdb_cursor(con)
         raise http_err
     except Exception as e:
-        if con: con.close()
+        if con: _close_duckdb_cursor(con)
         print(f"Unexpected error during operation ({engine}, {operation}): {type(e).__name__}: {e}")
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"An unexpected error occurred during the operation.")
     finally:
         if con:
-            try: con.close()
+            try: _close_duckdb_cursor(con)
             except Exception as close_err: print(f"Error closing DuckDB connection: {close_err}")
 
 # --- Undo/Reset/Save Transformation Endpoints (Updated for specific dataset) ---
 @app.post("/undo/{dataset_name}")
 async def undo_last_operation(dataset_name: str):
     """Reverts the dataset to the state before the last operation (if history exists)."""
+    return await _run_in_cpu_pool(_with_dataset_lock, dataset_name, _undo_last_operation, dataset_name)
+
+def _undo_last_operation(dataset_name: str):
+    """Blocking implementation of /undo (runs in cpu_pool under the dataset's lock)."""
     if dataset_name not in datasets_state: raise HTTPException(status_code=404, detail=f"Dataset '{dataset_name}' not found.")
     state_entry = datasets_state[dataset_name]
     history = state_entry.get("history", [])
@@ -1472,6 +1749,12 @@ async def undo_last_operation(dataset_name: str):
 
         # Restore content and potentially the SQL chain
         state_entry["content"] = previous_content
+        previous_metadata = last_step.get("previous_metadata")
+        if previous_metadata:
+            state_entry.update(previous_metadata)
+        else:
+            state_entry.pop("columns", None) # Recomputed on next full preview
+            state_entry.pop("row_count", None)
         # Restore SQL chain *only if* the undone step was also SQL or if we are reverting to an SQL state
         # If the previous step was SQL, `previous_sql_chain` should hold the chain *before* that step.
         state_entry["sql_chain"] = previous_sql_chain
@@ -1479,15 +1762,15 @@ async def undo_last_operation(dataset_name: str):
         print(f"Undo successful for {dataset_name}. Restored content. SQL chain set to: {'Present' if previous_sql_chain else 'None'}")
 
         data_type = state_entry["type"]
-        preview_info = _get_preview_from_content(previous_content, data_type) # Use data_type here
+        preview_info = _get_preview_from_content(previous_content, data_type, metadata=previous_metadata) # Use data_type here
 
-        return {
+        return ORJSONResponse({
             "message": f"Undid last change for {dataset_name}",
             "dataset_name": dataset_name, "dataset_type": data_type,
             "data": preview_info.get("data", []), "columns": preview_info.get("columns", []),
             "row_count": preview_info.get("row_count", 0),
             "can_undo": bool(history), "can_reset": bool(history)
-        }
+        })
     except HTTPException as http_err: raise http_err
     except Exception as e:
         print(f"Error during undo for '{dataset_name}': {type(e).__name__}: {e}")
@@ -1498,6 +1781,10 @@ async def undo_last_operation(dataset_name: str):
 @app.post("/reset/{dataset_name}")
 async def reset_transformations(dataset_name: str):
     """Resets the dataset by clearing its transformation history and SQL chain."""
+    return await _run_in_cpu_pool(_with_dataset_lock, dataset_name, _reset_transformations, dataset_name)
+
+def _reset_transformations(dataset_name: str):
+    """Blocking implementation of /reset (runs in cpu_pool under the dataset's lock)."""
     if dataset_name not in datasets_state: raise HTTPException(status_code=404, detail=f"Dataset '{dataset_name}' not found.")
     state_entry = datasets_state[dataset_name]
     if not state_entry.get("history"): raise HTTPException(status_code=400, detail=f"Dataset '{dataset_name}' has no history to reset.")
@@ -1509,61 +1796,20 @@ async def reset_transformations(dataset_name: str):
         current_content = state_entry["content"]
         data_type = state_entry["type"]
         print(f"Reset history and SQL chain for '{dataset_name}' (current content kept).")
-        preview_info = _get_preview_from_content(current_content, data_type) # Use data_type
+        preview_info = _get_preview_from_content(current_content, data_type, metadata=_cached_metadata(state_entry)) # Use data_type
 
-        return {
+        return ORJSONResponse({
             "message": f"Reset history for {dataset_name}",
             "dataset_name": dataset_name, "dataset_type": data_type,
             "data": preview_info.get("data", []), "columns": preview_info.get("columns", []),
             "row_count": preview_info.get("row_count", 0),
             "can_undo": False, "can_reset": False
-        }
+        })
     except Exception as e:
          print(f"Error during reset for '{dataset_name}': {type(e).__name__}: {e}")
          traceback.print_exc()
          raise HTTPException(status_code=500, detail=f"An error occurred during reset.")
 
-@app.post("/reset/{dataset_name}")
-async def reset_transformations(dataset_name: str):
-    """Resets the dataset by clearing its transformation history."""
-    # Note: This currently does NOT revert to the original uploaded file content.
-    # It only clears the undo history, keeping the current state.
-    if dataset_name not in datasets_state:
-        raise HTTPException(status_code=404, detail=f"Dataset '{dataset_name}' not found.")
-
-    state_entry = datasets_state[dataset_name]
-
-    if not state_entry.get("history"):
-         raise HTTPException(status_code=400, detail=f"Dataset '{dataset_name}' has no history to reset.")
-
-    try:
-        # Clear the history
-        state_entry["history"] = []
-        state_entry["sql_chain"] = None # Clear SQL chain on reset
-        current_content = state_entry["content"] # Keep current content after clearing history
-        print(f"Reset history and SQL chain for '{dataset_name}' (current content kept).")
-        data_type = state_entry["type"]
-
-        print(f"Reset history for '{dataset_name}' (current content kept).")
-
-        preview_info = _get_preview_from_content(current_content, data_type)
-
-        return {
-            "message": f"Reset history for {dataset_name}",
-            "dataset_name": dataset_name,
-            "dataset_type": data_type,
-            "data": preview_info.get("data", []),
-            "columns": preview_info.get("columns", []),
-            "row_count": preview_info.get("row_count", 0),
-            "can_undo": False, # History cleared
-            "can_reset": False # Cannot reset further
-        }
-    except Exception as e:
-         print(f"Error during reset for '{dataset_name}': {type(e).__name__}: {e}")
-         traceback.print_exc()
-         raise HTTPException(status_code=500, detail=f"An error occurred during reset.")
-
-
 # --- Export Endpoint (Operates on current content of specific dataset) ---
 @app.get("/export/{dataset_name}")
 async def export_dataset(
@@ -1585,11 +1831,11 @@ async def export_dataset(
         if format == "csv":
             media_type="text/csv"
             filename = f"{filename_base}_export.csv"
-            file_content = content
+            file_content = storage_service.to_csv_bytes(content)
         else:
             # Use pandas for consistent non-CSV export
             try:
-                 df = pd.read_csv(io.BytesIO(content))
+                 df = storage_service.read_pandas(content)
                  if format == "json":
                      media_type="application/json"
                      filename = f"{filename_base}_export.json"
@@ -1599,12 +1845,12 @@ async def export_dataset(
                          series = df.iloc[:, 0]
                          # Handle potential non-serializable data
                          series_serializable = series.replace([np.inf, -np.inf], None).copy()
-                         if pd.api.types.is_datetime64_any_dtype(series_serializable.dtype):
+                         if series_serializable.dtype.kind == 'M': # NumPy or Arrow-backed datetimes
                              series_serializable = series_serializable.astype(str)
                          file_content = series_serializable.to_json(orient="values", default_handler=str, force_ascii=False)
                      else: # Export DataFrame as records
                          df_serializable = df.replace([np.inf, -np.inf], None).copy()
-                         for col in df_serializable.select_dtypes(include=['datetime64[ns]', 'datetimetz']).columns:
+                         for col in df_serializable.select_dtypes(include=['datetime', 'datetimetz']).columns:
                              df_serializable[col] = df_serializable[col].astype(str)
                          file_content = df_serializable.to_json(orient="records", default_handler=str, force_ascii=False)
 
@@ -2,9 +2,103 @@
 import pandas as pd
 import io
 import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
 import traceback
 import re # Import re for regex operations
-from typing import Dict, Any, Tuple, List, Optional
+import functools
+import operator as _operator # Aliased: 'operator' is the filter param name below
+from typing import Dict, Any, Tuple, List, Optional, Union, Callable
+from . import storage_service
+
+# Filter comparison operators -> functions (elementwise on Series, so one lookup replaces an if/elif ladder)
+_COMPARISON_OPS = {"==": _operator.eq, "!=": _operator.ne, ">": _operator.gt, "<": _operator.lt, ">=": _operator.ge, "<=": _operator.le}
+
+# pandas aggregation -> (Arrow hash aggregate, options) computing it with pandas' semantics (see _arrow_group_by)
+_ARROW_GROUPBY_FUNCS = {
+    "mean": ("mean", None),
+    "sum": ("sum", pc.ScalarAggregateOptions(min_count=0)), # pandas: all-null group sums to 0
+    "count": ("count", None),
+    "min": ("min", None),
+    "max": ("max", None),
+    "nunique": ("count_distinct", None),
+    "std": ("stddev", pc.VarianceOptions(ddof=1)),
+    "var": ("variance", pc.VarianceOptions(ddof=1)),
+}
+
+@functools.lru_cache(maxsize=1024)
+def _compile_regex(pattern: str, flags: int = 0) -> re.Pattern:
+    """Compiles a regex once per (pattern, flags); repeated UI edits/re-runs reuse the compiled object."""
+    return re.compile(pattern, flags)
+
+def _as_str(series: pd.Series) -> pd.Series:
+    """
+    Column as strings for the .str methods. Arrow string columns (how stored frames load) are used as-is,
+    with nulls filled as '<NA>' like astype(str) writes them, instead of being copied into Python str objects.
+    """
+    if _is_arrow_string(series.dtype):
+        return series.fillna("<NA>") if series.hasnans else series
+    return series.astype(str)
+
+def _is_arrow_string(dtype) -> bool:
+    return isinstance(dtype, pd.ArrowDtype) and (pa.types.is_string(dtype.pyarrow_dtype) or pa.types.is_large_string(dtype.pyarrow_dtype))
+
+def _arrow_str_kernel(series: pd.Series, kernel: Callable[[Any], Any]):
+    """
+    Runs an Arrow string kernel over an Arrow string series as if on series.astype(str): the column is passed
+    as-is (no copy) and null results take the kernel's answer for '<NA>'.
+    """
+    result = kernel(pa.array(series))
+    if result.null_count:
+        result = pc.fill_null(result, kernel(pa.array(["<NA>"]))[0])
+    return result
+
+def _match_mask(series: pd.Series, kernel: Callable[[Any], Any]) -> np.ndarray:
+    """
+    Boolean mask of an Arrow string predicate over series as if on series.astype(str) (see _arrow_str_kernel);
+    columns that are not Arrow strings are converted to strings first.
+    """
+    if not _is_arrow_string(series.dtype):
+        series = series.astype(str)
+    return _arrow_str_kernel(series, kernel).to_numpy(zero_copy_only=False)
+
+_ARROW_STRING_FUNCS = {"upper": pc.utf8_upper, "lower": pc.utf8_lower, "strip": pc.utf8_trim_whitespace, "len": pc.utf8_length}
+
+def _str_transform(series: pd.Series, string_func: str) -> pd.Series:
+    """series.astype(str).str.<string_func>() for _ARROW_STRING_FUNCS; Arrow string columns skip the conversion."""
+    if _is_arrow_string(series.dtype):
+        result = _arrow_str_kernel(series, _ARROW_STRING_FUNCS[string_func])
+        return pd.Series(pd.arrays.ArrowExtensionArray(result), index=series.index, name=series.name)
+    return getattr(series.astype(str).str, string_func)()
+
+def _regex_contains(string_series: pd.Series, regex: str, flags: int = 0) -> np.ndarray:
+    """
+    Boolean match mask of regex over string_series (see _match_mask), computed by Arrow's RE2 kernel (linear time,
+    no per-row Python calls); patterns without metacharacters use a plain substring search instead.
+    Patterns RE2 cannot compile (backreferences, lookarounds) fall back to re.
+    """
+    ignore_case = bool(flags & re.IGNORECASE)
+    kernel = pc.match_substring if re.escape(regex) == regex else pc.match_substring_regex
+    try:
+        return _match_mask(string_series, lambda arr: kernel(arr, pattern=regex, ignore_case=ignore_case))
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+        # Python-only regex syntax: re works on Python strs
+        return string_series.astype(str).str.contains(_compile_regex(regex, flags), regex=True, na=False).to_numpy()
+
+def _select_rows(df: pd.DataFrame, mask: Union[pd.Series, np.ndarray]) -> pd.DataFrame:
+    """
+    Rows of df where the boolean mask is True (missing counts as False), like df[mask].
+    Frames made only of Arrow-backed columns (how stored frames load) are filtered by Arrow in one pass,
+    which beats pandas' boolean indexing on them; the result gets a fresh RangeIndex (storage drops the index).
+    """
+    if (
+        isinstance(df, pd.DataFrame) and len(df.columns) > 0 and df.columns.is_unique
+        and all(isinstance(name, str) for name in df.columns)
+        and all(isinstance(dtype, pd.ArrowDtype) for dtype in df.dtypes)
+    ):
+        table = pa.Table.from_pandas(df, preserve_index=False) # Zero-copy for Arrow-backed columns
+        return table.filter(pa.array(mask, type=pa.bool_())).to_pandas(types_mapper=pd.ArrowDtype)
+    return df[mask]
 
 def _is_numeric_col(df: pd.DataFrame, col_name: str) -> bool:
     if col_name not in df.columns:
@@ -12,75 +106,47 @@ def _is_numeric_col(df: pd.DataFrame, col_name: str) -> bool:
     if pd.api.types.is_numeric_dtype(df[col_name]):
         return True
     if df[col_name].dtype == 'object':
+        # Numeric if coercion adds no missing values; a short probe rejects text columns before the full pass
+        column = df[col_name]
         try:
-            # Use infer_objects().to_numeric() for potentially mixed types
-            pd.to_numeric(df[col_name].dropna().infer_objects(), errors='raise')
+            for values in (column.head(64), column):
+                if pd.to_numeric(values, errors='coerce').isna().sum() != values.isna().sum():
+                    return False
             return True
         except (ValueError, TypeError):
             return False
     return False
 
+def apply_pandas_operation_to_content(
+    content: storage_service.SharedContent, operation: str, params: Dict[str, Any], right_content: Optional[storage_service.SharedContent] = None
+) -> Tuple[storage_service.SharedContent, str, Dict[str, Any]]:
+    """
+    Content-in/content-out wrapper around apply_pandas_operation/apply_pandas_merge for worker processes.
+    Inputs and the serialized result are storage_service shared handles (spill files travel by path).
+    Touches no shared state; returns the result handle, the generated code and the
+    result's columns/row_count (the caller updates datasets_state).
+    """
+    df = storage_service.read_pandas(storage_service.open_shared(content))
+    if operation == 'merge':
+        result_df, code = apply_pandas_merge(df, storage_service.read_pandas(storage_service.open_shared(right_content)), params)
+    else:
+        result_df, code = apply_pandas_operation(df, operation, params)
+    frame_columns = result_df.to_frame().columns if isinstance(result_df, pd.Series) else result_df.columns
+    metadata = {"columns": [str(col) for col in frame_columns], "row_count": len(result_df)}
+    return storage_service.share_result(storage_service.serialize_pandas(result_df)), code, metadata
+
 def apply_pandas_operation(df: pd.DataFrame, operation: str, params: Dict[str, Any]) -> Tuple[pd.DataFrame, str]:
     """
     Applies a specified pandas operation to the DataFrame and returns the result
     along with the equivalent pandas code.
     """
     try:
-        # --- Existing Operations ---
-        if operation == "filter":
-            return _filter_rows_pd(df, params)
-        elif operation == "select_columns":
-            return _select_columns_pd(df, params)
-        elif operation == "sort":
-            return _sort_values_pd(df, params)
-        elif operation == "rename":
-            return _rename_columns_pd(df, params)
-        elif operation == "drop_columns":
-            return _drop_columns_pd(df, params)
-        elif operation == "groupby":
-            return _group_by_pd(df, params)
-        elif operation == "groupby_multi":
-            return _group_by_multi_pd(df, params)
-        elif operation == "groupby_multi_agg":
-             return _group_by_multi_agg_pd(df, params)
-        elif operation == "pivot_table":
-            return _pivot_table_pd(df, params)
-        elif operation == "melt":
-            return _melt_pd(df, params)
-        elif operation == "set_index":
-            return _set_index_pd(df, params)
-        elif operation == "reset_index":
-            return _reset_index_pd(df, params)
-        elif operation == "fillna":
-            return _fillna_pd(df, params)
-        elif operation == "dropna":
-             return _dropna_pd(df, params)
-        elif operation == "astype":
-             return _astype_pd(df, params)
-        elif operation == "string_operation":
-             return _string_op_pd(df, params)
-        elif operation == "date_extract":
-             return _date_extract_pd(df, params)
-        elif operation == "drop_duplicates":
-             return _drop_duplicates_pd(df, params)
-        elif operation == "create_column":
-             return _create_column_pd(df, params)
-        elif operation == "window_function":
-             return _window_function_pd(df, params)
-        elif operation == "sample":
-             return _sample_pd(df, params)
-        elif operation == "apply_lambda":
-             return _apply_lambda_pd(df, params)
-        elif operation == "shuffle": return _shuffle_pd(df, params)
-        elif operation.startswith("regex_"): # e.g., regex_filter, regex_extract, regex_replace
-             return apply_pandas_regex(df, operation.split('_', 1)[1], params)
-        elif operation == "string_operation": return _string_op_pd(df, params)
-        elif operation == "date_extract": return _date_extract_pd(df, params)
-        elif operation == "create_column": return _create_column_pd(df, params) # Uses eval! Risky.
-        elif operation == "window_function": return _window_function_pd(df, params)
-
-        else:
-            raise ValueError(f"Unsupported pandas operation: {operation}")
+        handler = _PANDAS_OPERATIONS.get(operation)
+        if handler is not None:
+            return handler(df, params)
+        if operation.startswith("regex_"): # e.g., regex_filter, regex_extract, regex_replace
+            return apply_pandas_regex(df, operation.split('_', 1)[1], params)
+        raise ValueError(f"Unsupported pandas operation: {operation}")
     except Exception as e:
         print(f"Error executing pandas operation '{operation}': {type(e).__name__}: {e}")
         raise e # Re-raise for main.py handler
@@ -100,19 +166,23 @@ def _filter_rows_pd(df: pd.DataFrame, params: Dict[str, Any]) -> Tuple[pd.DataFr
     original_value = value
     is_numeric_target = False
     try:
-        # Try to determine if the target column is numeric-like *before* filtering
-        if pd.api.types.is_numeric_dtype(df[column]):
-             is_numeric_target = True
-        # Check object type more carefully
-        elif df[column].dtype == 'object' and df[column].dropna().iloc[0] is not None:
-             # Attempt conversion on first non-null value
-             pd.to_numeric(df[column].dropna().iloc[0])
-             is_numeric_target = True # Looks numeric
+        # Try to determine if the target column is numeric-like *before* filtering.
+        # Only comparisons use this, and only object columns need to look at values.
+        if operator in _COMPARISON_OPS:
+            if pd.api.types.is_numeric_dtype(df[column].dtype):
+                 is_numeric_target = True
+            # Check object type more carefully
+            elif df[column].dtype == 'object':
+                 # Attempt conversion on first non-null value (located via one null mask, not a dropna() copy of the column)
+                 not_null = df[column].notna().to_numpy()
+                 if not_null.any():
+                     pd.to_numeric(df[column].iloc[not_null.argmax()])
+                     is_numeric_target = True # Looks numeric
     except (ValueError, TypeError, IndexError, KeyError):
          is_numeric_target = False # Treat as string if check fails or empty
 
     try:
-        if operator in ['==', '!=', '>', '<', '>=', '<='] and is_numeric_target:
+        if operator in _COMPARISON_OPS and is_numeric_target:
              if isinstance(value, str): # Only convert if input is string
                  if '.' in value or 'e' in value.lower(): value = float(value)
                  else: value = int(value)
@@ -124,49 +194,37 @@ def _filter_rows_pd(df: pd.DataFrame, params: Dict[str, Any]) -> Tuple[pd.DataFr
         # Keep as string if explicit conversion fails
         value = str(original_value)
 
-    code_value = repr(value) # Use repr for code generation
 
     condition_str = ""
     result_df = None
     col_expr = f"df['{column}']"
     # Handle potential type mismatches more robustly
     try:
-        if operator == "==":
-            condition_str = f"{col_expr} == {code_value}"
-            result_df = df[df[column] == value]
-        elif operator == "!=":
-            condition_str = f"{col_expr} != {code_value}"
-            result_df = df[df[column] != value]
-        # For comparisons, ensure types match or handle error
-        elif operator in ['>', '<', '>=', '<=']:
-             if is_numeric_target and isinstance(value, (int, float)):
-                 # Convert column to numeric if needed, coercing errors
-                 numeric_col = pd.to_numeric(df[column], errors='coerce')
-                 if operator == ">": condition_str, result_df = f"pd.to_numeric({col_expr}, errors='coerce') > {code_value}", df[numeric_col > value]
-                 elif operator == "<": condition_str, result_df = f"pd.to_numeric({col_expr}, errors='coerce') < {code_value}", df[numeric_col < value]
-                 elif operator == ">=": condition_str, result_df = f"pd.to_numeric({col_expr}, errors='coerce') >= {code_value}", df[numeric_col >= value]
-                 elif operator == "<=": condition_str, result_df = f"pd.to_numeric({col_expr}, errors='coerce') <= {code_value}", df[numeric_col <= value]
-             else: # Treat as string comparison if types incompatible
-                 str_col = df[column].astype(str)
-                 str_val = str(value)
-                 if operator == ">": condition_str, result_df = f"{col_expr}.astype(str) > {repr(str_val)}", df[str_col > str_val]
-                 elif operator == "<": condition_str, result_df = f"{col_expr}.astype(str) < {repr(str_val)}", df[str_col < str_val]
-                 elif operator == ">=": condition_str, result_df = f"{col_expr}.astype(str) >= {repr(str_val)}", df[str_col >= str_val]
-                 elif operator == "<=": condition_str, result_df = f"{col_expr}.astype(str) <= {repr(str_val)}", df[str_col <= str_val]
+        if operator in _COMPARISON_OPS:
+            if operator in ('==', '!='):
+                lhs_expr, lhs, rhs = col_expr, df[column], value
+            elif is_numeric_target and isinstance(value, (int, float)):
+                # Convert column to numeric if needed, coercing errors (numeric dtypes already are: skip the copy)
+                lhs = df[column] if pd.api.types.is_numeric_dtype(df[column].dtype) else pd.to_numeric(df[column], errors='coerce')
+                lhs_expr, rhs = f"pd.to_numeric({col_expr}, errors='coerce')", value
+            else: # Treat as string comparison if types incompatible
+                lhs_expr, lhs, rhs = f"{col_expr}.astype(str)", df[column].astype(str), str(value)
+            condition_str = f"{lhs_expr} {operator} {repr(rhs)}"
+            result_df = _select_rows(df, _COMPARISON_OPS[operator](lhs, rhs))
 
         # String operations
         elif operator == "contains":
             value_str = str(original_value)
             condition_str = f"{col_expr}.astype(str).str.contains({repr(value_str)}, na=False)"
-            result_df = df[df[column].astype(str).str.contains(value_str, na=False)]
+            result_df = _select_rows(df, _regex_contains(df[column], value_str)) # Regex match, like pandas' default
         elif operator == "startswith":
             value_str = str(original_value)
             condition_str = f"{col_expr}.astype(str).str.startswith({repr(value_str)}, na=False)"
-            result_df = df[df[column].astype(str).str.startswith(value_str, na=False)]
+            result_df = _select_rows(df, _match_mask(df[column], lambda arr: pc.starts_with(arr, pattern=value_str)))
         elif operator == "endswith":
             value_str = str(original_value)
             condition_str = f"{col_expr}.astype(str).str.endswith({repr(value_str)}, na=False)"
-            result_df = df[df[column].astype(str).str.endswith(value_str, na=False)]
+            result_df = _select_rows(df, _match_mask(df[column], lambda arr: pc.ends_with(arr, pattern=value_str)))
         # Note: 'regex' filter handled by apply_pandas_regex now
         else:
             raise ValueError(f"Unsupported filter operator: {operator}")
@@ -187,7 +245,11 @@ def _select_columns_pd(df: pd.DataFrame, params: Dict[str, Any]) -> Tuple[pd.Dat
         raise ValueError(f"Columns not found: {', '.join(missing)}")
 
     code = f"# Select specific columns\ndf = df[{repr(selected_columns)}]"
-    result_df = df[selected_columns]
+    positions = df.columns.get_indexer(selected_columns) if df.columns.is_unique else None
+    if positions is not None and np.array_equal(positions, np.arange(positions[0], positions[-1] + 1)):
+        result_df = df.iloc[:, positions[0]:positions[-1] + 1] # Contiguous run of columns: a slice keeps the blocks instead of copying them
+    else:
+        result_df = df[selected_columns]
     return result_df, code
 
 def _sort_values_pd(df: pd.DataFrame, params: Dict[str, Any]) -> Tuple[pd.DataFrame, str]:
@@ -218,7 +280,7 @@ def _rename_columns_pd(df: pd.DataFrame, params: Dict[str, Any]) -> Tuple[pd.Dat
         raise ValueError(f"Columns to rename not found: {', '.join(missing)}")
 
     code = f"# Rename columns\nrename_map = {repr(rename_dict)}\ndf = df.rename(columns=rename_map)"
-    result_df = df.rename(columns=rename_dict)
+    result_df = df.rename(columns=rename_dict, copy=False) # Relabel only: share the column data instead of copying it
     return result_df, code
 
 def _drop_columns_pd(df: pd.DataFrame, params: Dict[str, Any]) -> Tuple[pd.DataFrame, str]:
@@ -253,9 +315,7 @@ def _group_by_pd(df: pd.DataFrame, params: Dict[str, Any]) -> Tuple[pd.DataFrame
 
     # --- Add Validation ---
     numeric_only_funcs = ['mean', 'median', 'std', 'var', 'sum']
-    is_numeric = _is_numeric_col(df, agg_column)
-
-    if agg_function in numeric_only_funcs and not is_numeric:
+    if agg_function in numeric_only_funcs and not _is_numeric_col(df, agg_column): # Only scanned when it matters
         raise ValueError(f"Aggregation function '{agg_function}' requires a numeric column, but '{agg_column}' is not numeric.")
     # --- End Validation ---
 
@@ -264,14 +324,52 @@ def _group_by_pd(df: pd.DataFrame, params: Dict[str, Any]) -> Tuple[pd.DataFrame
     agg_spec = {agg_column: agg_function}
     code += f"df = df.groupby('{group_column}').agg({repr(agg_spec)}).reset_index()"
 
-    # Using .agg() handles potential errors more gracefully sometimes
-    result_df = df.groupby(group_column).agg(agg_spec).reset_index()
-    # Pandas might create multi-index columns if agg_column was already the index name, handle it
+    result_df = _arrow_group_by(df, [group_column], agg_spec)
+    if result_df is None:
+        # Using .agg() handles potential errors more gracefully sometimes
+        result_df = df.groupby(group_column, as_index=False).agg(agg_spec) # Keys as columns directly, no reset_index copy
+    # Pandas might create multi-index columns if agg_column was already the index name, handle it.
+    # Single function, so the second level carries nothing: keep the column names.
     if isinstance(result_df.columns, pd.MultiIndex):
-         result_df.columns = ['_'.join(col).strip('_') for col in result_df.columns.values]
+         result_df.columns = result_df.columns.get_level_values(0)
 
     return result_df, code
 
+def _arrow_group_by(df: pd.DataFrame, group_columns: List[str], agg_spec: Dict[str, Union[str, List[str]]]) -> Optional[pd.DataFrame]:
+    """
+    groupby for the reductions in _ARROW_GROUPBY_FUNCS via Arrow's hash aggregation, on Arrow-backed columns
+    (how stored frames load, so no conversion). Matches df.groupby(...).agg(agg_spec).reset_index() with
+    MultiIndex columns flattened to 'col_func': null keys dropped, keys sorted, sum of an all-null group is 0.
+    Returns None when pandas should handle it.
+    """
+    funcs_by_column = {col: [funcs] if isinstance(funcs, str) else list(funcs) for col, funcs in agg_spec.items()}
+    if any(col in group_columns for col in funcs_by_column) or not all(
+        func in _ARROW_GROUPBY_FUNCS for funcs in funcs_by_column.values() for func in funcs
+    ):
+        return None
+    columns = list(group_columns) + list(funcs_by_column)
+    if not all(isinstance(df[col].dtype, pd.ArrowDtype) for col in columns):
+        return None
+    if any(pa.types.is_floating(df[col].dtype.pyarrow_dtype) for col in group_columns):
+        return None # NaN keys: pandas drops them as missing, Arrow groups them as a value
+    table = pa.Table.from_pandas(df[columns], preserve_index=False) # Zero-copy for Arrow-backed columns
+    aggregations = [(col, *_ARROW_GROUPBY_FUNCS[func]) for col, funcs in funcs_by_column.items() for func in funcs]
+    try:
+        grouped = table.group_by(list(group_columns)).aggregate(aggregations)
+    except pa.ArrowNotImplementedError:
+        return None # No Arrow kernel for this type (pandas raises its own error or handles it)
+    valid_keys = functools.reduce(pc.and_, [pc.is_valid(grouped[col]) for col in group_columns])
+    grouped = grouped.filter(valid_keys).sort_by([(col, "ascending") for col in group_columns])
+
+    result = {col: grouped[col].to_pandas(types_mapper=pd.ArrowDtype) for col in group_columns}
+    for col, funcs in funcs_by_column.items():
+        for func in funcs:
+            name = col if isinstance(agg_spec[col], str) else f"{col}_{func}"
+            values = grouped[f"{col}_{_ARROW_GROUPBY_FUNCS[func][0]}"]
+            # pandas returns nunique as numpy int64 even for Arrow-backed input
+            result[name] = values.to_pandas() if func == "nunique" else values.to_pandas(types_mapper=pd.ArrowDtype)
+    return pd.DataFrame(result)
+
 def _group_by_multi_pd(df: pd.DataFrame, params: Dict[str, Any]) -> Tuple[pd.DataFrame, str]:
     group_columns = params.get("group_columns") # Expecting a list
     agg_column = params.get("agg_column")
@@ -294,8 +392,7 @@ def _group_by_multi_pd(df: pd.DataFrame, params: Dict[str, Any]) -> Tuple[pd.Dat
 
     # --- Add Validation ---
     numeric_only_funcs = ['mean', 'median', 'std', 'var', 'sum']
-    is_numeric = _is_numeric_col(df, agg_column)
-    if agg_function in numeric_only_funcs and not is_numeric:
+    if agg_function in numeric_only_funcs and not _is_numeric_col(df, agg_column): # Only scanned when it matters
         raise ValueError(f"Aggregation function '{agg_function}' requires a numeric column, but '{agg_column}' is not numeric.")
     # --- End Validation ---
 
@@ -303,9 +400,11 @@ def _group_by_multi_pd(df: pd.DataFrame, params: Dict[str, Any]) -> Tuple[pd.Dat
     agg_spec = {agg_column: agg_function}
     code += f"df = df.groupby({repr(group_columns)}).agg({repr(agg_spec)}).reset_index()"
 
-    result_df = df.groupby(group_columns).agg(agg_spec).reset_index()
+    result_df = _arrow_group_by(df, group_columns, agg_spec)
+    if result_df is None:
+        result_df = df.groupby(group_columns, as_index=False).agg(agg_spec)
     if isinstance(result_df.columns, pd.MultiIndex):
-        result_df.columns = ['_'.join(col).strip('_') for col in result_df.columns.values]
+        result_df.columns = result_df.columns.get_level_values(0) # Single function: second level is constant
 
     return result_df, code
 
@@ -326,6 +425,7 @@ def _group_by_multi_agg_pd(df: pd.DataFrame, params: Dict[str, Any]) -> Tuple[pd
     agg_dict = {}
     valid_funcs = ['mean', 'sum', 'count', 'min', 'max', 'median', 'std', 'var', 'first', 'last', 'nunique']
     numeric_only_funcs = ['mean', 'median', 'std', 'var', 'sum']
+    numeric_columns = {} # _is_numeric_col scans object columns, so each column is checked once
 
     for agg_spec in aggregations:
         col = agg_spec.get("column")
@@ -338,9 +438,11 @@ def _group_by_multi_agg_pd(df: pd.DataFrame, params: Dict[str, Any]) -> Tuple[pd
             raise ValueError(f"Unsupported aggregation function: {func}")
 
         # --- Add Validation ---
-        is_numeric = _is_numeric_col(df, col)
-        if func in numeric_only_funcs and not is_numeric:
-             raise ValueError(f"Aggregation function '{func}' requires a numeric column, but '{col}' is not numeric.")
+        if func in numeric_only_funcs:
+            if col not in numeric_columns:
+                numeric_columns[col] = _is_numeric_col(df, col)
+            if not numeric_columns[col]:
+                raise ValueError(f"Aggregation function '{func}' requires a numeric column, but '{col}' is not numeric.")
         # --- End Validation ---
 
         if col not in agg_dict:
@@ -356,22 +458,30 @@ def _group_by_multi_agg_pd(df: pd.DataFrame, params: Dict[str, Any]) -> Tuple[pd
 
     code = f"# Group by {group_columns} with multiple aggregations\n"
     code += f"agg_spec = {repr(agg_dict)}\n"
-    code += f"df = df.groupby({repr(group_columns)}).agg(agg_spec).reset_index()\n"
-    code += "# Note: Column names might be multi-level depending on pandas version.\n"
-    code += "# Flattening columns if necessary:\n"
-    code += "if isinstance(df.columns, pd.MultiIndex):\n"
-    code += "    df.columns = ['_'.join(col).strip('_') for col in df.columns.values]"
+    code += "# Named aggregations give flat 'column_function' result columns\n"
+    code += f"df = df.groupby({repr(group_columns)}, as_index=False).agg(**{{f'{{col}}_{{func}}': pd.NamedAgg(column=col, aggfunc=func) for col, funcs in agg_spec.items() for func in funcs}})"
 
 
-    result_df = df.groupby(group_columns).agg(agg_dict)
-    # Flatten MultiIndex columns if pandas creates them
-    if isinstance(result_df.columns, pd.MultiIndex):
-        result_df.columns = ['_'.join(col).strip('_') for col in result_df.columns.values]
-
-    result_df = result_df.reset_index()
+    result_df = _arrow_group_by(df, group_columns, agg_dict) # Already flat and reset
+    if result_df is None:
+        named_aggs = {f"{col}_{func}": pd.NamedAgg(column=col, aggfunc=func) for col, funcs in agg_dict.items() for func in funcs}
+        result_df = df.groupby(group_columns, as_index=False).agg(**named_aggs) # Flat columns, no MultiIndex to rebuild
 
     return result_df, code
 
+def _arrow_pivot_table(df: pd.DataFrame, index_col: Any, columns_col: Any, values_col: Any, aggfunc: str) -> Optional[pd.DataFrame]:
+    """
+    pd.pivot_table for one index, columns and values column: aggregates by Arrow (see _arrow_group_by) and only
+    reshapes the aggregated frame. Aggregates that come out null are dropped first, as pivot_table's dropna does.
+    Returns None when pandas should handle it.
+    """
+    if not all(isinstance(col, str) for col in (index_col, columns_col, values_col)) or index_col == columns_col:
+        return None
+    grouped = _arrow_group_by(df, [index_col, columns_col], {values_col: aggfunc})
+    if grouped is None:
+        return None
+    return grouped.dropna(subset=[values_col]).pivot(index=index_col, columns=columns_col, values=values_col)
+
 def _pivot_table_pd(df: pd.DataFrame, params: Dict[str, Any]) -> Tuple[pd.DataFrame, str]:
     index_col = params.get("index_col") # Can be list or string
     columns_col = params.get("columns_col") # Can be list or string
@@ -403,12 +513,37 @@ def _pivot_table_pd(df: pd.DataFrame, params: Dict[str, Any]) -> Tuple[pd.DataFr
     code += "# Reset index if you want index columns back as regular columns\n"
     code += "# df = df.reset_index()"
 
-    result_df = pd.pivot_table(df, index=index_col, columns=columns_col, values=values_col, aggfunc=aggfunc)
+    result_df = _arrow_pivot_table(df, index_col, columns_col, values_col, aggfunc)
+    if result_df is None:
+        result_df = pd.pivot_table(df, index=index_col, columns=columns_col, values=values_col, aggfunc=aggfunc)
     # Resetting index is common after pivot, but keep it as index for now.
     # result_df = result_df.reset_index()
 
     return result_df, code
 
+def _arrow_melt(df: pd.DataFrame, id_vars: List[str], value_vars: List[str], var_name: str, value_name: str) -> Optional[pd.DataFrame]:
+    """
+    pd.melt for Arrow-backed columns of one type (how stored frames load): the id columns are repeated and the
+    value columns chained chunk by chunk without copying; only the variable labels are built (from a dictionary).
+    Same rows and order as pd.melt. Returns None when pandas should handle it.
+    """
+    columns = list(id_vars) + list(value_vars)
+    if not value_vars or len(df) == 0 or len(set(columns)) != len(columns) or not df.columns.is_unique:
+        return None
+    if var_name == value_name or var_name in df.columns or value_name in df.columns:
+        return None # Name clashes: pandas raises or renames
+    if not all(isinstance(df[col].dtype, pd.ArrowDtype) for col in columns):
+        return None
+    table = pa.Table.from_pandas(df[columns], preserve_index=False) # Zero-copy for Arrow-backed columns
+    if len({table[col].type for col in value_vars}) != 1:
+        return None # Mixed value types: pandas finds the common dtype
+    repeats = len(value_vars)
+    result = {col: pa.chunked_array(table[col].chunks * repeats, type=table[col].type) for col in id_vars}
+    codes = pa.array(np.repeat(np.arange(repeats, dtype=np.int32), len(table)))
+    result[var_name] = pa.DictionaryArray.from_arrays(codes, pa.array(value_vars, type=pa.string())).cast(pa.string())
+    result[value_name] = pa.chunked_array([chunk for col in value_vars for chunk in table[col].chunks], type=table[value_vars[0]].type)
+    return pa.table(result).to_pandas(types_mapper=pd.ArrowDtype)
+
 def _melt_pd(df: pd.DataFrame, params: Dict[str, Any]) -> Tuple[pd.DataFrame, str]:
     id_vars = params.get("id_vars") # List of columns to keep
     value_vars = params.get("value_vars") # List of columns to melt
@@ -430,7 +565,9 @@ def _melt_pd(df: pd.DataFrame, params: Dict[str, Any]) -> Tuple[pd.DataFrame, st
     code += f"             var_name='{var_name}',\n"
     code += f"             value_name='{value_name}')"
 
-    result_df = pd.melt(df, id_vars=id_vars, value_vars=value_vars, var_name=var_name, value_name=value_name)
+    result_df = _arrow_melt(df, id_vars, value_vars, var_name, value_name)
+    if result_df is None:
+        result_df = pd.melt(df, id_vars=id_vars, value_vars=value_vars, var_name=var_name, value_name=value_name)
     return result_df, code
 
 def _set_index_pd(df: pd.DataFrame, params: Dict[str, Any]) -> Tuple[pd.DataFrame, str]:
@@ -628,11 +765,11 @@ def _string_op_pd(df: pd.DataFrame, params: Dict[str, Any]) -> Tuple[pd.DataFram
         if func_lower == 'split':
              result_df[new_col_name] = result_df[column].astype(str).str.split(delimiter, expand=False).str.get(int(part_index))
         elif func_lower == 'upper':
-             result_df[new_col_name] = result_df[column].astype(str).str.upper()
+             result_df[new_col_name] = _as_str(result_df[column]).str.upper()
         elif func_lower == 'lower':
-             result_df[new_col_name] = result_df[column].astype(str).str.lower()
+             result_df[new_col_name] = _as_str(result_df[column]).str.lower()
         elif func_lower == 'strip':
-             result_df[new_col_name] = result_df[column].astype(str).str.strip()
+             result_df[new_col_name] = _as_str(result_df[column]).str.strip()
 
     except Exception as e:
         raise ValueError(f"Error applying string function '{string_func}': {e}")
@@ -881,18 +1018,20 @@ def apply_pandas_regex(df: pd.DataFrame, operation: str, params: Dict[str, Any])
     code_flags = f", flags=re.IGNORECASE" if not params.get("case_sensitive", True) else ""
 
     try:
+        # Compile up front (cached): invalid patterns fail before touching the column
+        pattern = _compile_regex(regex, flags)
         # Ensure target column is string type for regex ops
-        string_series = df[column].astype(str)
+        string_series = _as_str(df[column])
 
         if operation == "filter":
             code += f"df = df[df['{column}'].astype(str).str.contains({repr(regex)}, regex=True, na=False{code_flags})]"
-            result_df = df[string_series.str.contains(regex, regex=True, na=False, flags=flags)]
+            result_df = _select_rows(df, _regex_contains(string_series, regex, flags))
         elif operation == "extract":
             new_column = params.get("new_column", f"{column}_extracted")
             # Extract first match (group 0)
             code += f"df['{new_column}'] = df['{column}'].astype(str).str.extract(f'({regex})', expand=False{code_flags})"
             result_df = df.copy() # Modify copy
-            result_df[new_column] = string_series.str.extract(f'({regex})', expand=False, flags=flags)
+            result_df[new_column] = string_series.astype(str).str.extract(_compile_regex(f'({regex})', flags), expand=False) # Arrow strings only take named groups
         elif operation == "extract_group":
             new_column = params.get("new_column", f"{column}_group_{params.get('group', 1)}")
             group = params.get("group", 1) # Default to group 1
@@ -904,7 +1043,7 @@ def apply_pandas_regex(df: pd.DataFrame, operation: str, params: Dict[str, Any])
             result_df = df.copy()
             # Use pandas str.extract which correctly extracts specified groups
             # If regex has one group, it returns Series. If multiple, DataFrame.
-            extracted = string_series.str.extract(regex, expand=True, flags=flags)
+            extracted = string_series.astype(str).str.extract(pattern, expand=True)
 
             if isinstance(extracted, pd.DataFrame):
                 if int(group) - 1 < extracted.shape[1]: # Check if group index is valid (0-based for iloc)
@@ -922,16 +1061,15 @@ def apply_pandas_regex(df: pd.DataFrame, operation: str, params: Dict[str, Any])
         elif operation == "replace":
             replacement = params.get("replacement", "")
             new_column = params.get("new_column") # Optional: if provided, create new col
-            # regex_compiled = re.compile(regex, flags=flags) # Compile for efficiency? Optional.
 
             if new_column:
                 code += f"df['{new_column}'] = df['{column}'].astype(str).str.replace({repr(regex)}, {repr(replacement)}, regex=True{code_flags})"
                 result_df = df.copy()
-                result_df[new_column] = string_series.str.replace(regex, replacement, regex=True, flags=flags)
+                result_df[new_column] = string_series.astype(str).str.replace(pattern, replacement, regex=True) # re replacement syntax
             else: # Replace in place (on copy)
                 code += f"df['{column}'] = df['{column}'].astype(str).str.replace({repr(regex)}, {repr(replacement)}, regex=True{code_flags})"
                 result_df = df.copy()
-                result_df[column] = string_series.str.replace(regex, replacement, regex=True, flags=flags)
+                result_df[column] = string_series.astype(str).str.replace(pattern, replacement, regex=True)
         else:
              raise ValueError(f"Unsupported regex operation type: {operation}")
 
@@ -954,7 +1092,7 @@ def _string_op_pd(df: pd.DataFrame, params: Dict[str, Any]) -> Tuple[pd.DataFram
     if column not in df.columns:
         raise ValueError(f"Column '{column}' not found.")
 
-    result_df = df.copy()
+    result_df = df.copy(deep=False) # Only a column is added/replaced, which never writes into the shared data
     code = f"# Apply string operation '{string_func}' to column '{column}'\n"
     op_series = None
     op_code_str = ""
@@ -966,23 +1104,23 @@ def _string_op_pd(df: pd.DataFrame, params: Dict[str, Any]) -> Tuple[pd.DataFram
         func_lower = string_func.lower()
         if func_lower == 'upper':
             op_code_str = f"{str_series_code}.upper()"
-            op_series = result_df[column].astype(str).str.upper()
+            op_series = _str_transform(result_df[column], 'upper')
         elif func_lower == 'lower':
             op_code_str = f"{str_series_code}.lower()"
-            op_series = result_df[column].astype(str).str.lower()
+            op_series = _str_transform(result_df[column], 'lower')
         elif func_lower == 'strip':
             op_code_str = f"{str_series_code}.strip()"
-            op_series = result_df[column].astype(str).str.strip()
+            op_series = _str_transform(result_df[column], 'strip')
         elif func_lower == 'len':
             op_code_str = f"{str_series_code}.len()"
-            op_series = result_df[column].astype(str).str.len()
+            op_series = _str_transform(result_df[column], 'len')
         elif func_lower == 'split':
             if delimiter is None or part_index is None:
                 raise ValueError("String split requires 'delimiter' and 'part_index' (0-based).")
             idx = int(part_index)
             op_code_str = f"{str_series_code}.split({repr(delimiter)}, expand=True)[{idx}]"
             # Use expand=True and select column index. Fill NA for rows where split doesn't yield enough parts.
-            op_series = result_df[column].astype(str).str.split(delimiter, expand=True).get(idx) # .get(idx) handles missing index gracefully -> None
+            op_series = _as_str(result_df[column]).str.split(delimiter, expand=True).get(idx) # .get(idx) handles missing index gracefully -> None
         else:
             raise ValueError(f"Unsupported string_function for pandas: {string_func}")
 
@@ -1225,16 +1363,16 @@ def generate_pandas_code_snippet(operation: str, params: Dict[str, Any], df_var:
         return f"# TODO: Implement pandas code snippet for {operation}"
 
 
-def replay_pandas_operations(original_content: bytes, history: List[Dict[str, Any]]) -> Tuple[bytes, str]:
+def replay_pandas_operations(original_content: storage_service.Content, history: List[Dict[str, Any]]) -> Tuple[storage_service.Content, str]:
     """
     Replays a list of pandas operations from the original content.
-    Returns the final content (bytes) and the cumulative code string.
+    Returns the final content (as stored in state) and the cumulative code string.
     """
     if not history:
         return original_content, "# No operations applied"
 
     try:
-        current_df = pd.read_csv(io.BytesIO(original_content))
+        current_df = storage_service.read_pandas(original_content)
     except Exception as e:
         raise ValueError(f"Failed to load original data for replay: {e}")
 
@@ -1309,11 +1447,9 @@ def replay_pandas_operations(original_content: bytes, history: List[Dict[str, An
         except Exception as e:
             raise ValueError(f"Error replaying pandas step {i+1} ({op}): {e}\nCode: {code_snippet}")
 
-    # Convert final DataFrame back to bytes
+    # Convert final DataFrame back to stored content
     try:
-        with io.BytesIO() as buffer:
-            current_df.to_csv(buffer, index=False)
-            final_content = buffer.getvalue()
+        final_content = storage_service.store_pandas(current_df) # Stored format (Arrow IPC), no intermediate CSV buffer
     except Exception as e:
         raise ValueError(f"Failed to serialize final pandas DataFrame: {e}")
 
@@ -1361,4 +1497,33 @@ def _apply_lambda_pd(df: pd.DataFrame, params: Dict[str, Any]) -> Tuple[pd.DataF
         traceback.print_exc()
         raise ValueError(f"Error applying lambda to column '{column}': {e}. Check function logic and column data type.") from e
 
-    return result_df, code
\ No newline at end of file
+    return result_df, code
+
+
+# Operation name -> handler. Built after every _*_pd definition so the later
+# (current) definitions of the helpers that appear twice in this module win.
+_PANDAS_OPERATIONS = {
+    "filter": _filter_rows_pd,
+    "select_columns": _select_columns_pd,
+    "sort": _sort_values_pd,
+    "rename": _rename_columns_pd,
+    "drop_columns": _drop_columns_pd,
+    "groupby": _group_by_pd,
+    "groupby_multi": _group_by_multi_pd,
+    "groupby_multi_agg": _group_by_multi_agg_pd,
+    "pivot_table": _pivot_table_pd,
+    "melt": _melt_pd,
+    "set_index": _set_index_pd,
+    "reset_index": _reset_index_pd,
+    "fillna": _fillna_pd,
+    "dropna": _dropna_pd,
+    "astype": _astype_pd,
+    "string_operation": _string_op_pd,
+    "date_extract": _date_extract_pd,
+    "drop_duplicates": _drop_duplicates_pd,
+    "create_column": _create_column_pd, # Uses eval! Risky.
+    "window_function": _window_function_pd,
+    "sample": _sample_pd,
+    "apply_lambda": _apply_lambda_pd,
+    "shuffle": _shuffle_pd,
+}
@@ -5,7 +5,9 @@ import io
 import numpy as np
 import re # Import re for regex
 import traceback
+import operator as _operator # Aliased: 'operator' is the filter param name below
 from typing import Dict, Any, Tuple, List, Optional
+from . import storage_service
 
 # --- Helper ---
 def _is_numeric_dtype_pl(df: pl.DataFrame, col_name: str) -> bool:
@@ -62,6 +64,9 @@ def apply_polars_operation(df: pl.DataFrame, operation: str, params: Dict[str, A
 
 # --- Specific Operations ---
 
+# Filter comparison operators -> functions (polars expressions overload them, so one lookup builds the predicate)
+_COMPARISON_OPS = {"==": _operator.eq, "!=": _operator.ne, ">": _operator.gt, "<": _operator.lt, ">=": _operator.ge, "<=": _operator.le}
+
 def _filter_rows_pl(df: pl.DataFrame, params: Dict[str, Any]) -> Tuple[pl.DataFrame, str]:
     column = params.get("column")
     operator = params.get("operator")
@@ -81,7 +86,7 @@ def _filter_rows_pl(df: pl.DataFrame, params: Dict[str, Any]) -> Tuple[pl.DataFr
     # Attempt type coercion of the *value* based on column dtype
     try:
         target_val = value
-        if operator in ['==', '!=', '>', '<', '>=', '<=']:
+        if operator in _COMPARISON_OPS:
             if pl.datatypes.is_numeric(target_dtype) and isinstance(value, (str, int, float)):
                 # Safely try to cast value to column's numeric type
                 try: target_val = pl.lit(value).cast(target_dtype).item() # Get scalar value
@@ -111,24 +116,9 @@ def _filter_rows_pl(df: pl.DataFrame, params: Dict[str, Any]) -> Tuple[pl.DataFr
         # Using pl.lit() ensures correct type handling in the expression
         lit_val = pl.lit(target_val)
 
-        if operator == "==":
-            condition_expr_str = f"{col_expr_str} == {value_repr}"
-            pl_filter_expr = pl.col(column) == lit_val
-        elif operator == "!=":
-            condition_expr_str = f"{col_expr_str} != {value_repr}"
-            pl_filter_expr = pl.col(column) != lit_val
-        elif operator == ">":
-            condition_expr_str = f"{col_expr_str} > {value_repr}"
-            pl_filter_expr = pl.col(column) > lit_val
-        elif operator == "<":
-            condition_expr_str = f"{col_expr_str} < {value_repr}"
-            pl_filter_expr = pl.col(column) < lit_val
-        elif operator == ">=":
-            condition_expr_str = f"{col_expr_str} >= {value_repr}"
-            pl_filter_expr = pl.col(column) >= lit_val
-        elif operator == "<=":
-            condition_expr_str = f"{col_expr_str} <= {value_repr}"
-            pl_filter_expr = pl.col(column) <= lit_val
+        if operator in _COMPARISON_OPS:
+            condition_expr_str = f"{col_expr_str} {operator} {value_repr}"
+            pl_filter_expr = _COMPARISON_OPS[operator](pl.col(column), lit_val)
         # String ops need cast for safety if column isn't already Utf8
         elif operator == "contains":
             str_val = str(original_value)
@@ -976,17 +966,16 @@ def generate_polars_code_snippet(operation: str, params: Dict[str, Any], df_var:
         return f"# TODO: Implement polars code snippet for {operation}"
 
 
-def replay_polars_operations(original_content: bytes, history: List[Dict[str, Any]]) -> Tuple[bytes, str]:
+def replay_polars_operations(original_content: storage_service.Content, history: List[Dict[str, Any]]) -> Tuple[storage_service.Content, str]:
     """
     Replays a list of polars operations from the original content.
-    Returns the final content (bytes) and the cumulative code string.
+    Returns the final content (as stored in state) and the cumulative code string.
     """
     if not history:
         return original_content, "# No operations applied"
 
     try:
-        # Use scan_csv for potentially better performance? Or read_csv is fine.
-        current_df = pl.read_csv(io.BytesIO(original_content))
+        current_df = storage_service.read_polars(original_content)
     except Exception as e:
         raise ValueError(f"Failed to load original data for Polars replay: {e}")
 
@@ -1047,11 +1036,9 @@ def replay_polars_operations(original_content: bytes, history: List[Dict[str, An
         except Exception as e:
             raise ValueError(f"Error replaying polars step {i+1} ({op}): {e}\nCode: {code_snippet}")
 
-    # Convert final DataFrame back to bytes
+    # Convert final DataFrame back to stored content
     try:
-        with io.BytesIO() as buffer:
-            current_df.write_csv(buffer)
-            final_content = buffer.getvalue()
+        final_content = storage_service.store_polars(current_df) # Stored format (Arrow IPC), no intermediate CSV buffer
     except Exception as e:
         raise ValueError(f"Failed to serialize final polars DataFrame: {e}")
 
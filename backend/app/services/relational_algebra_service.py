@@ -1,11 +1,10 @@
 # backend/app/services/relational_algebra_service.py
 import duckdb
 import pandas as pd
-import io
-import re 
 from typing import Dict, Any, Tuple, List, Optional
-import json
 import uuid 
+from . import storage_service
+from .sql_service import _arrow_preview_records
 
 # --- Utility Functions (Can potentially be shared with sql_service) ---
 
@@ -28,24 +27,16 @@ def _sanitize_identifier(identifier: Optional[str]) -> Optional[str]:
     # Always wrap the final result in double quotes
     return f'"{escaped_identifier}"'
 
-def _load_ra_data(con: duckdb.DuckDBPyConnection, table_name: str, content: bytes):
-    """Loads data from CSV bytes content into a DuckDB table using Pandas."""
+def _load_ra_data(con: duckdb.DuckDBPyConnection, table_name: str, content: storage_service.Content):
+    """Registers stored content with DuckDB as an Arrow table under the dataset name (zero-copy, no CREATE TABLE copy)."""
     # Use the corrected sanitizer
     sanitized_table_name = _sanitize_identifier(table_name)
     if not sanitized_table_name:
         raise ValueError("Invalid table name provided for loading RA data.")
     try:
-        # Read CSV bytes into a Pandas DataFrame
-        df_temp = pd.read_csv(io.BytesIO(content))
-        # Register the DataFrame as a temporary view in DuckDB
-        # Make view name safer by removing potentially problematic chars
-        safe_base_name = re.sub(r'\W|^(?=\d)', '_', table_name) # Replace non-word chars, ensure not starting with digit
-        view_name = f'__temp_ra_view_{safe_base_name}_{uuid.uuid4().hex[:4]}'
-        con.register(view_name, df_temp) # Use unique view name
-        # Create the final table from the view
-        con.execute(f"CREATE OR REPLACE TABLE {sanitized_table_name} AS SELECT * FROM {view_name};")
-        # Clean up the temporary view
-        con.unregister(view_name)
+        arrow_table = storage_service.read_arrow(content)
+        # register() takes the raw name; strip the quoting added by the sanitizer
+        con.register(sanitized_table_name[1:-1].replace('""', '"'), arrow_table)
         print(f"Successfully loaded data into DuckDB table: {sanitized_table_name}") # Add confirmation log
     except (pd.errors.ParserError, pd.errors.EmptyDataError, duckdb.Error, Exception) as e:
         raise ValueError(f"Failed to load data for RA op into table {table_name}: {type(e).__name__} - {e}")
@@ -181,34 +172,12 @@ def _execute_preview_query(con: duckdb.DuckDBPyConnection, query: str, preview_l
         total_rows_result = con.execute(count_query).fetchone()
         total_rows = total_rows_result[0] if total_rows_result else 0
 
-        preview_query = f"WITH result_set AS ({query}) SELECT * FROM result_set LIMIT {preview_limit};"
-        preview_result = con.execute(preview_query)
-
-        columns = [desc[0] for desc in preview_result.description]
-        preview_df = preview_result.fetchdf() # Fetch as DataFrame first
-
-        # Convert df to dicts, handling non-serializable types robustly
-        data_dicts = []
-        for record in preview_df.to_dict(orient='records'):
-            formatted_record = {}
-            for col, val in record.items():
-                if pd.isna(val):
-                    formatted_record[col] = None # Consistent null representation
-                elif isinstance(val, (bytes, bytearray)):
-                     # Try decoding, fallback to placeholder
-                    try: formatted_record[col] = val.decode('utf-8', errors='replace')
-                    except: formatted_record[col] = f"<binary data len={len(val)}>"
-                else:
-                    # Attempt direct JSON serialization check for complex types
-                    try:
-                        json.dumps(val) # Test if serializable
-                        formatted_record[col] = val
-                    except TypeError:
-                        # If not serializable, convert known types or fallback to string
-                        if hasattr(val, 'isoformat'): formatted_record[col] = val.isoformat() # Date/Time
-                        elif isinstance(val, (list, dict)): formatted_record[col] = str(val) # Simple string for lists/dicts
-                        else: formatted_record[col] = str(val) # Generic fallback
-            data_dicts.append(formatted_record)
+        preview_query = f"WITH result_set AS ({query}) SELECT * FROM result_set LIMIT ?;"
+        preview_result = con.execute(preview_query, [preview_limit]) # Limit bound as a parameter, not formatted into the SQL
+
+        preview_table = preview_result.arrow()
+        columns = preview_table.column_names
+        data_dicts = _arrow_preview_records(preview_table) # JSON-safe values, converted column-wise by Arrow
 
         return data_dicts, columns, total_rows
 
@@ -1,10 +1,11 @@
 # backend/app/services/sql_service.py
 import duckdb
-import pandas as pd
-import io
+import pyarrow as pa
+import pyarrow.compute as pc
 import re
 import traceback
 from typing import Dict, Any, Tuple, List, Optional
+from . import storage_service
 
 # --- Helper Functions ---
 
@@ -35,18 +36,51 @@ def _sanitize_identifier(name: str, allow_star=False) -> str:
 
     return '.'.join(sanitized_parts)
 
-def _load_data_to_duckdb(con: duckdb.DuckDBPyConnection, table_name: str, content: bytes):
-    """Loads CSV content bytes into a DuckDB table using pandas for robust parsing."""
+def _arrow_preview_records(table: pa.Table) -> List[Dict]:
+    """
+    Preview rows as dicts built by Arrow (no pandas frame, no per-cell boxing in Python).
+    NaN becomes None; decimals become floats (as fetchdf() did); binary and interval/duration
+    values become strings so the rows stay JSON-serializable.
+    """
+    for i, field in enumerate(table.schema):
+        column = table.column(i)
+        if pa.types.is_floating(field.type):
+            column = pc.if_else(pc.is_nan(column), pa.scalar(None, field.type), column)
+        elif pa.types.is_decimal(field.type):
+            column = column.cast(pa.float64())
+        elif pa.types.is_binary(field.type) or pa.types.is_large_binary(field.type):
+            column = pa.array([v.decode('utf-8', errors='replace') if v is not None else None for v in column.to_pylist()], pa.string())
+        elif pa.types.is_interval(field.type) or pa.types.is_duration(field.type):
+            column = pa.array([str(v) if v is not None else None for v in column.to_pylist()], pa.string())
+        else:
+            continue
+        table = table.set_column(i, field.name, column)
+    return table.to_pylist()
+
+def _sql_string_literal(value: Any) -> str:
+    """
+    Quotes a value as a SQL string literal (single quotes doubled). Step SQL is kept as chain text
+    and re-run by later steps, so user values are embedded this way rather than bound as parameters.
+    """
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def _sql_value_literal(value: Any) -> str:
+    """Numbers as SQL numeric literals, anything else as a string literal."""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    return _sql_string_literal(value)
+
+
+def _load_data_to_duckdb(con: duckdb.DuckDBPyConnection, table_name: str, content: storage_service.Content) -> pa.Table:
+    """Registers stored content with DuckDB as an Arrow table (zero-copy scan, no re-parsing) and returns the table."""
     try:
-        # Use pandas to read CSV first for better type inference and error handling
-        df = pd.read_csv(io.BytesIO(content))
-        # Register the DataFrame directly. Use the raw table_name for registration.
+        arrow_table = storage_service.read_arrow(content)
+        # Register the Arrow table directly. Use the raw table_name for registration.
         # DuckDB handles the table name internally. No need to sanitize here for registration.
-        con.register(table_name, df)
-        print(f"Successfully registered DataFrame as table '{table_name}' in DuckDB.")
-    except pd.errors.EmptyDataError:
-        print(f"Warning: CSV content for table '{table_name}' is empty. Registering empty table.")
-        con.register(table_name, pd.DataFrame())
+        con.register(table_name, arrow_table)
+        print(f"Successfully registered Arrow table as '{table_name}' in DuckDB.")
+        return arrow_table
     except Exception as e:
         print(f"Error loading data for table '{table_name}' into DuckDB: {type(e).__name__}: {e}")
         traceback.print_exc()
@@ -54,6 +88,22 @@ def _load_data_to_duckdb(con: duckdb.DuckDBPyConnection, table_name: str, conten
         raise ValueError(f"Failed to load data into DuckDB table '{table_name}': {e}")
 
 
+def _execute_with_preview(con: duckdb.DuckDBPyConnection, query: str, materialize: bool) -> Tuple[List[Dict], List[str], int, Optional[pa.Table]]:
+    """
+    Preview rows, columns and total row count of query. With materialize, the query runs once to Arrow and
+    everything comes from that table (returned too); otherwise a LIMIT 100 preview plus a COUNT(*) query.
+    """
+    if materialize:
+        result_table = con.execute(query).arrow()
+        preview_table = result_table.slice(0, 100)
+        return _arrow_preview_records(preview_table), preview_table.column_names, result_table.num_rows, result_table
+    preview_table = con.execute(f"{query} LIMIT ?", [100]).arrow() # Bound limit: the statement text is the same for every preview
+    # Get total row count (can be expensive)
+    # Use COUNT(*) on the final step definition for better performance than fetching all
+    total_rows = con.execute(f"SELECT COUNT(*) FROM ({query}) AS final_count").fetchone()[0]
+    return _arrow_preview_records(preview_table), preview_table.column_names, total_rows, None
+
+
 def _build_cte_chain(previous_sql_chain: str, current_step_sql: str, step_number: int) -> Tuple[str, str]:
     """Builds a chain of CTEs for SQL operations."""
     step_alias = f"step{step_number}"
@@ -100,6 +150,57 @@ def _build_cte_chain(previous_sql_chain: str, current_step_sql: str, step_number
     return full_chain, current_cte_snippet
 
 
+def _sql_regex_step(con: duckdb.DuckDBPyConnection, source_relation: str, operation: str, params: Dict[str, Any]) -> str:
+    """
+    Builds the SELECT for a regex operation (filter, extract, extract_group, replace)
+    using DuckDB's vectorized RE2 functions instead of row-by-row Python regex.
+    """
+    column = params.get("column")
+    regex = params.get("regex")
+    if not column or regex is None:
+        raise ValueError("Regex operations require 'column' and 'regex'.")
+
+    # Validate the pattern with a bound parameter first so bad input fails with a clear error
+    try:
+        con.execute("SELECT regexp_matches('', ?)", [regex]).fetchone()
+    except duckdb.Error as regex_err:
+        raise ValueError(f"Invalid regular expression: {regex_err}")
+
+    # The chain is stored as SQL text, so the pattern is embedded as an escaped literal
+    s_col = f"{_sanitize_identifier(column)}::VARCHAR"
+    sql_regex = _sql_string_literal(regex)
+    case_flag = "" if params.get("case_sensitive", True) else "i"
+    options = f", '{case_flag}'" if case_flag else ""
+
+    if operation == "filter":
+        return f"SELECT * FROM {source_relation} WHERE regexp_matches({s_col}, {sql_regex}{options})"
+    elif operation == "extract":
+        new_column = _sanitize_identifier(params.get("new_column", f"{column}_extracted"))
+        return f"SELECT *, regexp_extract({s_col}, {sql_regex}, 0{options}) AS {new_column} FROM {source_relation}"
+    elif operation == "extract_group":
+        group = int(params.get("group", 1))
+        new_column = _sanitize_identifier(params.get("new_column", f"{column}_group_{group}"))
+        return f"SELECT *, regexp_extract({s_col}, {sql_regex}, {group}{options}) AS {new_column} FROM {source_relation}"
+    elif operation == "replace":
+        replacement = _sql_string_literal(params.get("replacement", ""))
+        sql_expr = f"regexp_replace({s_col}, {sql_regex}, {replacement}, 'g{case_flag}')" # 'g': replace all matches like str.replace
+        new_column = params.get("new_column")
+        if new_column:
+            return f"SELECT *, {sql_expr} AS {_sanitize_identifier(new_column)} FROM {source_relation}"
+        return f"SELECT * REPLACE ({sql_expr} AS {_sanitize_identifier(column)}) FROM {source_relation}"
+    raise ValueError(f"Unsupported regex operation type: {operation}")
+
+
+def _source_columns(con: duckdb.DuckDBPyConnection, describe_source: str, known_columns: Optional[List[str]], purpose: str) -> List[str]:
+    """Columns of a step's source: the caller's known columns when given, else a DESCRIBE round-trip."""
+    if known_columns is not None:
+        return list(known_columns)
+    try:
+        return [c[0] for c in con.execute(f"DESCRIBE ({describe_source});").fetchall()]
+    except Exception as desc_err:
+        raise ValueError(f"Could not describe source for {purpose}: {desc_err}")
+
+
 # --- Core Operation Functions ---
 
 def apply_sql_operation(
@@ -107,8 +208,10 @@ def apply_sql_operation(
     previous_sql_chain: str,
     operation: str,
     params: Dict[str, Any],
-    base_table_ref: str # The original, registered table name (unsanitized)
-) -> Tuple[List[Dict], List[str], int, str, str]:
+    base_table_ref: str, # The original, registered table name (unsanitized)
+    known_columns: Optional[List[str]] = None, # Columns of the source if the caller already has them
+    materialize: bool = False # Also return the full result as an Arrow table (one query instead of preview+count+full)
+) -> Tuple[List[Dict], List[str], int, str, str, Optional[pa.Table]]:
     """
     Applies a structured SQL operation, extending the CTE chain.
 
@@ -118,6 +221,8 @@ def apply_sql_operation(
         operation: The name of the operation (e.g., 'filter', 'groupby_multi_agg').
         params: Dictionary of parameters for the operation.
         base_table_ref: The name of the base table registered in DuckDB (e.g., '__datasetname_base').
+        known_columns: Columns of previous_sql_chain's result (e.g. cached metadata); saves DESCRIBE round-trips.
+        materialize: Execute the full query once and derive the preview and row count from its result.
 
     Returns:
         Tuple containing:
@@ -126,6 +231,7 @@ def apply_sql_operation(
         - total_rows: Total number of rows in the result.
         - new_full_sql_chain: The updated SQL query string including the new operation as a CTE.
         - sql_snippet: The SQL snippet (CTE definition) for the current operation.
+        - result_table: The full result (including a requested ORDER BY) if materialize, else None.
     """
     step_number = 0
     source_relation = _sanitize_identifier(base_table_ref) # Start with base table if no chain
@@ -152,6 +258,8 @@ def apply_sql_operation(
             source_relation = "( " + previous_sql_chain + " ) AS prev_step" # Less ideal, but works
             step_number = 1 # Assume it's the first step after the complex previous one
 
+    describe_source = previous_sql_chain if step_number > 0 else source_relation # Only DESCRIBEd if known_columns is missing
+
     # --- Generate SQL Snippet for the current operation ---
     current_step_sql = ""
     order_by_clause = "" # Store ORDER BY separately as it applies at the end
@@ -161,18 +269,13 @@ def apply_sql_operation(
             op = params['operator']
             val = params.get('value') # May not exist for IS NULL/NOT NULL
             # Basic value quoting (improve for different types if needed)
-            sql_val = ""
-            if op not in ['isnull', 'notnull']:
-                if isinstance(val, (int, float)) and not isinstance(val, bool):
-                    sql_val = str(val)
-                else: # Treat as string, requires escaping single quotes
-                    escaped_val = str(val).replace("'", "''")
-                    sql_val = f"'{escaped_val}'"
+            sql_val = _sql_value_literal(val) if op not in ['isnull', 'notnull'] else ""
             if op == 'isnull': current_step_sql = f"SELECT * FROM {source_relation} WHERE {col} IS NULL"
             elif op == 'notnull': current_step_sql = f"SELECT * FROM {source_relation} WHERE {col} IS NOT NULL"
-            elif op == 'contains': current_step_sql = f"SELECT * FROM {source_relation} WHERE {col} LIKE '%{str(val).replace('%', '%%').replace('_', '__')}%'" # Basic LIKE escape
-            elif op == 'startswith': current_step_sql = f"SELECT * FROM {source_relation} WHERE {col} LIKE '{str(val).replace('%', '%%').replace('_', '__')}%'"
-            elif op == 'endswith': current_step_sql = f"SELECT * FROM {source_relation} WHERE {col} LIKE '%{str(val).replace('%', '%%').replace('_', '__')}'"
+            # Substring builtins instead of LIKE: no wildcard escaping, and prefix/suffix checks compare bytes directly
+            elif op in ('contains', 'startswith', 'endswith'):
+                str_func = {'contains': 'contains', 'startswith': 'starts_with', 'endswith': 'ends_with'}[op]
+                current_step_sql = f"SELECT * FROM {source_relation} WHERE {str_func}({col}::VARCHAR, {_sql_string_literal(val)})"
             elif op == 'regex': current_step_sql = f"SELECT * FROM {source_relation} WHERE regexp_matches({col}::VARCHAR, {sql_val})" # DuckDB regex
             elif op in ['==', '!=', '>', '<', '>=', '<=']:
                 # Use standard SQL operators, handle == as =
@@ -205,13 +308,7 @@ def apply_sql_operation(
         elif operation == "rename":
             select_clauses = []
             # Get columns from the source relation
-            try: # <<< Line 158 area - Added try
-                 # Use previous chain directly if it exists and is not just the base table ref
-                 describe_source = previous_sql_chain if step_number > 0 else source_relation
-                 cols_info = con.execute(f"DESCRIBE ({describe_source});").fetchall()
-                 source_columns = [c[0] for c in cols_info]
-            except Exception as desc_err: # <<< Added except block
-                 raise ValueError(f"Could not describe source for rename: {desc_err}")
+            source_columns = _source_columns(con, describe_source, known_columns, "rename")
 
             rename_map = {item['old_name']: item['new_name'] for item in params['renames']}
             for col in source_columns:
@@ -225,12 +322,7 @@ def apply_sql_operation(
 
         elif operation == "drop_columns":
             select_clauses = []
-            try:
-                 describe_source = previous_sql_chain if step_number > 0 else source_relation
-                 cols_info = con.execute(f"DESCRIBE ({describe_source});").fetchall()
-                 source_columns = [c[0] for c in cols_info]
-            except Exception as desc_err:
-                 raise ValueError(f"Could not describe source for drop: {desc_err}")
+            source_columns = _source_columns(con, describe_source, known_columns, "drop")
 
             cols_to_drop = set(params['drop_columns'])
             for col in source_columns:
@@ -285,20 +377,9 @@ def apply_sql_operation(
             if fill_value is None:
                  raise ValueError("SQL fillna requires a 'value' to fill with.")
 
-            # Quote fill value if string
-            sql_fill_val = ""
-            if isinstance(fill_value, (int, float)) and not isinstance(fill_value, bool):
-                sql_fill_val = str(fill_value)
-            else:
-                escaped_fill_value = str(fill_value).replace("'", "''")
-                sql_fill_val = f"'{escaped_fill_value}'"
+            sql_fill_val = _sql_value_literal(fill_value) # Quoted if string
 
-            try:
-                 describe_source = previous_sql_chain if step_number > 0 else source_relation
-                 cols_info = con.execute(f"DESCRIBE ({describe_source});").fetchall()
-                 source_columns = [c[0] for c in cols_info]
-            except Exception as desc_err:
-                 raise ValueError(f"Could not describe source for fillna: {desc_err}")
+            source_columns = _source_columns(con, describe_source, known_columns, "fillna")
 
             select_clauses = []
             target_cols = set(columns_to_fill) if columns_to_fill else set(source_columns)
@@ -318,12 +399,7 @@ def apply_sql_operation(
             subset = params.get('subset') # Optional list of columns to check
             # 'how' ('any'/'all') and 'thresh' are more complex
 
-            try:
-                 describe_source = previous_sql_chain if step_number > 0 else source_relation
-                 cols_info = con.execute(f"DESCRIBE ({describe_source});").fetchall()
-                 source_columns = [c[0] for c in cols_info]
-            except Exception as desc_err:
-                 raise ValueError(f"Could not describe source for dropna: {desc_err}")
+            source_columns = _source_columns(con, describe_source, known_columns, "dropna")
 
             target_cols = subset if subset else source_columns
             where_clauses = [f"{_sanitize_identifier(col)} IS NOT NULL" for col in target_cols]
@@ -350,12 +426,7 @@ def apply_sql_operation(
             sql_type = type_map.get(new_type)
             if not sql_type: raise ValueError(f"Unsupported type for SQL CAST: {new_type}")
 
-            try:
-                 describe_source = previous_sql_chain if step_number > 0 else source_relation
-                 cols_info = con.execute(f"DESCRIBE ({describe_source});").fetchall()
-                 source_columns = [c[0] for c in cols_info]
-            except Exception as desc_err:
-                 raise ValueError(f"Could not describe source for astype: {desc_err}")
+            source_columns = _source_columns(con, describe_source, known_columns, "astype")
 
             select_clauses = []
             s_target_col = _sanitize_identifier(col)
@@ -380,12 +451,7 @@ def apply_sql_operation(
              # Use DISTINCT ON (DuckDB specific) or ROW_NUMBER()
              # DISTINCT ON is simpler if available and keep='first'
              # Need an ordering for DISTINCT ON to be deterministic, use all columns?
-             try:
-                 describe_source = previous_sql_chain if step_number > 0 else source_relation
-                 all_cols_info = con.execute(f"DESCRIBE ({describe_source});").fetchall()
-                 order_by_cols = ", ".join([_sanitize_identifier(c[0]) for c in all_cols_info])
-             except Exception as desc_err:
-                 raise ValueError(f"Could not describe source for drop_duplicates ordering: {desc_err}")
+             order_by_cols = ", ".join(_sanitize_identifier(c) for c in _source_columns(con, describe_source, known_columns, "drop_duplicates ordering"))
 
 
              if partition_cols == "*": # Distinct on all columns is just DISTINCT
@@ -446,12 +512,7 @@ def apply_sql_operation(
 
              sql_expr = lambda_str.replace('x', _sanitize_identifier(col))
 
-             try:
-                 describe_source = previous_sql_chain if step_number > 0 else source_relation
-                 cols_info = con.execute(f"DESCRIBE ({describe_source});").fetchall()
-                 source_columns = [c[0] for c in cols_info]
-             except Exception as desc_err:
-                 raise ValueError(f"Could not describe source for apply_lambda: {desc_err}")
+             source_columns = _source_columns(con, describe_source, known_columns, "apply_lambda")
 
              select_clauses = []
              target_col_found = False
@@ -485,6 +546,9 @@ def apply_sql_operation(
 
              current_step_sql = f"SELECT {', '.join(select_clauses)} FROM {source_relation}"
 
+        elif operation.startswith("regex_"):
+            current_step_sql = _sql_regex_step(con, source_relation, operation.split('_', 1)[1], params)
+
         # --- Add New Operations Here ---
         elif operation == "string_operation":
              col = params['column']
@@ -507,18 +571,12 @@ def apply_sql_operation(
                  if delimiter is None or part_index is None:
                      raise ValueError("SQL String split requires 'delimiter' and 'part_index' (1-based).")
                  # DuckDB string_split returns a list, access with list_extract
-                 escaped_delimiter = str(delimiter).replace("'", "''")
-                 sql_expr = f"list_extract(string_split({s_col}::VARCHAR, '{escaped_delimiter}'), {int(part_index)})"
+                 sql_expr = f"list_extract(string_split({s_col}::VARCHAR, {_sql_string_literal(delimiter)}), {int(part_index)})"
              else:
                  raise ValueError(f"Unsupported string_function for SQL: {string_func}")
 
              # Build SELECT statement, adding the new column
-             try:
-                 describe_source = previous_sql_chain if step_number > 0 else source_relation
-                 cols_info = con.execute(f"DESCRIBE ({describe_source});").fetchall()
-                 source_columns = [_sanitize_identifier(c[0]) for c in cols_info]
-             except Exception as desc_err:
-                 raise ValueError(f"Could not describe source for string_operation: {desc_err}")
+             source_columns = [_sanitize_identifier(c) for c in _source_columns(con, describe_source, known_columns, "string_operation")]
 
              select_list = ", ".join(source_columns)
              current_step_sql = f"SELECT {select_list}, ({sql_expr}) AS {_sanitize_identifier(new_col_name)} FROM {source_relation}"
@@ -548,12 +606,7 @@ def apply_sql_operation(
                  raise ValueError(f"Unsupported date part for SQL: {part}. Valid: {valid_parts}")
 
              # Build SELECT statement
-             try:
-                 describe_source = previous_sql_chain if step_number > 0 else source_relation
-                 cols_info = con.execute(f"DESCRIBE ({describe_source});").fetchall()
-                 source_columns = [_sanitize_identifier(c[0]) for c in cols_info]
-             except Exception as desc_err:
-                 raise ValueError(f"Could not describe source for date_extract: {desc_err}")
+             source_columns = [_sanitize_identifier(c) for c in _source_columns(con, describe_source, known_columns, "date_extract")]
 
              select_list = ", ".join(source_columns)
              current_step_sql = f"SELECT {select_list}, ({sql_expr}) AS {_sanitize_identifier(new_col_name)} FROM {source_relation}"
@@ -571,12 +624,7 @@ def apply_sql_operation(
              # User needs to ensure the expression is valid SQL.
 
              # Build SELECT statement
-             try:
-                 describe_source = previous_sql_chain if step_number > 0 else source_relation
-                 cols_info = con.execute(f"DESCRIBE ({describe_source});").fetchall()
-                 source_columns = [_sanitize_identifier(c[0]) for c in cols_info]
-             except Exception as desc_err:
-                 raise ValueError(f"Could not describe source for create_column: {desc_err}")
+             source_columns = [_sanitize_identifier(c) for c in _source_columns(con, describe_source, known_columns, "create_column")]
 
              select_list = ", ".join(source_columns)
              # Basic check for injection - disallow semicolons within the expression
@@ -638,13 +686,7 @@ def apply_sql_operation(
                  offset_val = int(offset)
                  default_clause = ""
                  if default_value is not None:
-                     # Quote default if string
-                     sql_default = ""
-                     if isinstance(default_value, (int, float)) and not isinstance(default_value, bool): sql_default = str(default_value)
-                     else: 
-                        escaped_default = str(default_value).replace("'", "''")
-                        sql_default = f"'{escaped_default}'"
-                     default_clause = f", {sql_default}"
+                     default_clause = f", {_sql_value_literal(default_value)}" # Quoted if string
                  sql_func_call = f"{func.upper()}({s_target_col}, {offset_val}{default_clause}) OVER {window_spec}"
              elif func_lower in ['sum', 'avg', 'mean', 'min', 'max', 'count', 'stddev_samp', 'var_samp', 'median', 'first_value', 'last_value']:
                  sql_agg_func = func.upper()
@@ -666,12 +708,7 @@ def apply_sql_operation(
                  raise ValueError(f"Unsupported window function for SQL: {func}")
 
              # Build SELECT statement
-             try:
-                 describe_source = previous_sql_chain if step_number > 0 else source_relation
-                 cols_info = con.execute(f"DESCRIBE ({describe_source});").fetchall()
-                 source_columns = [_sanitize_identifier(c[0]) for c in cols_info]
-             except Exception as desc_err:
-                 raise ValueError(f"Could not describe source for window_function: {desc_err}")
+             source_columns = [_sanitize_identifier(c) for c in _source_columns(con, describe_source, known_columns, "window_function")]
 
              select_list = ", ".join(source_columns)
              current_step_sql = f"SELECT {select_list}, {sql_func_call} AS {_sanitize_identifier(new_col_name)} FROM {source_relation}"
@@ -710,14 +747,7 @@ def apply_sql_operation(
     # --- Execute and Get Preview ---
     try:
         print(f"Executing SQL for preview:\n{final_query_for_execution}\n---")
-        preview_result = con.execute(f"{final_query_for_execution} LIMIT 101").fetchdf() # Fetch 101 to check if > 100
-        preview_data = preview_result.head(100).replace({pd.NA: None, pd.NaT: None}).to_dict(orient="records") # Replace pandas NAs
-        result_columns = list(preview_result.columns)
-
-        # Get total row count (can be expensive)
-        # Use COUNT(*) on the final step definition for better performance than fetching all
-        count_sql = f"SELECT COUNT(*) FROM ({final_query_for_execution}) AS final_count"
-        total_rows = con.execute(count_sql).fetchone()[0]
+        preview_data, result_columns, total_rows, result_table = _execute_with_preview(con, final_query_for_execution, materialize)
 
     except Exception as exec_err:
         print(f"Error executing generated SQL: {type(exec_err).__name__}: {exec_err}")
@@ -726,7 +756,7 @@ def apply_sql_operation(
 
     # Return the chain *without* the final ORDER BY for further CTE building,
     # but the executed query included it.
-    return preview_data, result_columns, total_rows, new_full_sql_chain, sql_snippet
+    return preview_data, result_columns, total_rows, new_full_sql_chain, sql_snippet, result_table
 
 
 def apply_sql_join(
@@ -734,8 +764,10 @@ def apply_sql_join(
     previous_sql_chain_left: str,
     right_table_ref: str, # Sanitized name of the right table registered in DuckDB
     params: Dict[str, Any],
-    base_table_ref_left: str # Original registered name of the left base table
-) -> Tuple[List[Dict], List[str], int, str, str]:
+    base_table_ref_left: str, # Original registered name of the left base table
+    materialize: bool = False, # Also return the full result as an Arrow table, see apply_sql_operation
+    tables: Optional[Dict[str, pa.Table]] = None # Registered name -> Arrow table of the joined tables (required for join_strategy hints)
+) -> Tuple[List[Dict], List[str], int, str, str, Optional[pa.Table]]:
     """
     Applies a SQL JOIN operation, extending the CTE chain for the left side.
     """
@@ -757,6 +789,13 @@ def apply_sql_join(
     left_on = _sanitize_identifier(params['left_on'])
     right_on = _sanitize_identifier(params['right_on'])
     join_type = params.get('join_type', 'inner').upper()
+    # 'auto': DuckDB's cost-based join order/build side. 'hash'/'broadcast': always build the hash
+    # table on the right dataset as written (for when cardinality estimates pick the wrong side).
+    join_strategy = params.get('join_strategy', 'auto').lower()
+    if join_strategy == 'sort_merge':
+        raise ValueError("Join strategy 'sort_merge' is not available: DuckDB executes equi-joins as hash joins. Use 'auto' or 'hash'.")
+    if join_strategy not in ['auto', 'hash', 'broadcast']:
+        raise ValueError(f"Unsupported join strategy for SQL: {join_strategy}")
     # Suffixes are handled implicitly by column naming or explicit selection if needed
 
     # --- Build Join SQL ---
@@ -775,21 +814,40 @@ def apply_sql_join(
     # --- Build CTE Chain ---
     new_full_sql_chain, sql_snippet = _build_cte_chain(previous_sql_chain_left, current_step_sql, step_number)
 
+    # A join strategy hint needs disabled_optimizers, which is database-wide: run the step on a private
+    # in-memory connection with the tables registered on it, so no other query sees the setting
+    exec_con = con
+    if join_strategy != 'auto':
+        if not tables:
+            raise ValueError(f"Join strategy '{join_strategy}' needs the joined tables (tables=...) to run on its own connection.")
+        exec_con = duckdb.connect(":memory:")
+        for table_name, arrow_table in tables.items():
+            exec_con.register(table_name, arrow_table)
+        # Only the optimizers this DuckDB version has (build_side_probe_side is missing from older ones)
+        disabled_optimizers = ",".join(row[0] for row in exec_con.execute(
+            "SELECT name FROM duckdb_optimizers() WHERE name IN ('join_order', 'build_side_probe_side') ORDER BY name DESC"
+        ).fetchall())
+        if disabled_optimizers:
+            exec_con.execute(f"SET disabled_optimizers = '{disabled_optimizers}';")
+            sql_snippet += f"\n-- Join strategy: {join_strategy} (build side: right dataset). This step ran on its own connection with:"
+            sql_snippet += f"\n-- SET disabled_optimizers = '{disabled_optimizers}';"
+        else:
+            sql_snippet += f"\n-- Join strategy: {join_strategy} not supported by this DuckDB version; default plan used"
+
     # --- Execute and Get Preview ---
     try:
         print(f"Executing SQL Join for preview:\n{new_full_sql_chain}\n---")
-        preview_result = con.execute(f"{new_full_sql_chain} LIMIT 101").fetchdf()
-        preview_data = preview_result.head(100).replace({pd.NA: None, pd.NaT: None}).to_dict(orient="records")
-        result_columns = list(preview_result.columns) # May contain duplicate names if not handled
-
-        count_sql = f"SELECT COUNT(*) FROM ({new_full_sql_chain}) AS final_count"
-        total_rows = con.execute(count_sql).fetchone()[0]
+        # DuckDB suffixes duplicate column names (e.g. "id_1")
+        preview_data, result_columns, total_rows, result_table = _execute_with_preview(exec_con, new_full_sql_chain, materialize)
 
     except Exception as exec_err:
         print(f"Error executing generated SQL Join: {type(exec_err).__name__}: {exec_err}")
         traceback.print_exc()
         # Ensure f-string here is correct and variables are defined
         raise ValueError(f"Generated SQL Join failed execution: {exec_err}\nSQL:\n{new_full_sql_chain}") # <<< Line 791 area (syntax looks ok)
+    finally:
+        if exec_con is not con:
+            exec_con.close()
 
     # Ensure the function returns correctly
-    return preview_data, result_columns, total_rows, new_full_sql_chain, sql_snippet
\ No newline at end of file
+    return preview_data, result_columns, total_rows, new_full_sql_chain, sql_snippet, result_table
\ No newline at end of file
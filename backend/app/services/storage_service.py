@@ -0,0 +1,385 @@
+# backend/app/services/storage_service.py
+import collections
+import io
+import mmap
+import os
+import tempfile
+import threading
+import weakref
+import pandas as pd
+import polars as pl
+import pyarrow as pa
+import pyarrow.csv # Multi-threaded CSV reader for uploads
+from typing import List, Union
+
+# --- Configuration ---
+# Content larger than this is written to a temp file and memory-mapped instead of
+# being kept as a Python bytes object, so the kernel can page it out under pressure.
+SPILL_THRESHOLD_BYTES = int(os.environ.get("DATAMAID_SPILL_THRESHOLD_BYTES", 16 * 1024 * 1024))
+SPILL_DIR = os.environ.get("DATAMAID_SPILL_DIR", tempfile.gettempdir())
+# Content is an Arrow IPC file (default) or CSV text (frames Arrow cannot type). CSV is kept
+# LZ4-framed so history snapshots of it stay small; both formats are told apart by their magic.
+ARROW_IPC_MAGIC = b"ARROW1"
+LZ4_FRAME_MAGIC = b"\x04\x22\x4d\x18"
+IPC_WRITE_OPTIONS = pa.ipc.IpcWriteOptions(compression="lz4")
+_LZ4 = pa.Codec("lz4") # Frame format, same codec family as the IPC buffers
+# In-memory (non-spilled) content across all datasets and undo history is kept under this many bytes;
+# beyond it the coldest content is moved to mmap-backed files, see spill().
+MEMORY_BUDGET_BYTES = int(os.environ.get("DATAMAID_MEMORY_BUDGET_BYTES", 1024 * 1024 * 1024))
+# IPC files are written in record batches of at most this many rows, so a page of a large
+# (spilled) dataset only needs the batches up to offset+limit decompressed, not the whole file.
+IPC_BATCH_ROWS = int(os.environ.get("DATAMAID_IPC_BATCH_ROWS", 64 * 1024))
+# Decoded Arrow tables of in-memory content (IPC, or parsed CSV) are kept (LRU) up to this many bytes, so
+# repeated previews/stats/operations on the same content skip decompression and decoding.
+ARROW_CACHE_BYTES = int(os.environ.get("DATAMAID_ARROW_CACHE_BYTES", 256 * 1024 * 1024))
+
+
+def _release_spill_file(mapped: mmap.mmap, path: str):
+    """Closes the mapping and removes the backing file once the content is unreferenced."""
+    try:
+        mapped.close()
+    except BufferError:
+        pass # A memoryview is still alive; the mapping is closed when it is collected
+    try:
+        os.remove(path)
+    except OSError as e:
+        print(f"Error cleaning up spill file {path}: {e}")
+
+
+def _write_spill_file(data: Union[bytes, pa.Buffer]) -> str:
+    fd, path = tempfile.mkstemp(prefix="datamaid_", suffix=".bin", dir=SPILL_DIR)
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    return path
+
+
+class SpilledContent:
+    """
+    Dataset content backed by a read-only memory-mapped temp file.
+    Stored in datasets_state (and history) in place of bytes for large datasets.
+    """
+    def __init__(self, data: Union[bytes, pa.Buffer]):
+        self._map(_write_spill_file(data), owned=True)
+
+    @classmethod
+    def from_file(cls, path: str, owned: bool) -> "SpilledContent":
+        """Maps an existing spill file; with owned, the file is removed along with the last reference like new content."""
+        content = cls.__new__(cls)
+        content._map(path, owned)
+        return content
+
+    def _map(self, path: str, owned: bool):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if owned:
+            # Remove the file when the last reference (state entry or history step) goes away
+            weakref.finalize(self, _release_spill_file, self._mmap, self.path)
+
+    def __len__(self) -> int:
+        return len(self._mmap)
+
+    def view(self) -> memoryview:
+        """Zero-copy view over the mapped pages."""
+        return memoryview(self._mmap)
+
+
+Content = Union[bytes, SpilledContent]
+
+
+def store_content(data: Union[bytes, pa.Buffer]) -> Content:
+    """
+    Returns the representation to keep in state: bytes for small data, a mmap-backed file otherwise.
+    Arrow buffers are written to the spill file directly, so large results are never copied into bytes.
+    """
+    if len(data) > SPILL_THRESHOLD_BYTES:
+        return SpilledContent(data)
+    return data.to_pybytes() if isinstance(data, pa.Buffer) else data
+
+
+# Worker processes get content as a picklable handle: small content as bytes, spilled content as its file path,
+# which the worker maps itself instead of receiving a pickled copy of the whole file.
+SharedContent = Union[bytes, pa.Buffer, str]
+
+
+def share_content(content: Content) -> SharedContent:
+    """Handle for sending stored content to a worker process. The caller keeps content alive until the worker is done."""
+    return content.path if isinstance(content, SpilledContent) else content
+
+
+def share_result(data: Union[bytes, pa.Buffer]) -> SharedContent:
+    """Handle for returning serialized data from a worker; large results are spilled here and handed over by path."""
+    if len(data) > SPILL_THRESHOLD_BYTES:
+        return _write_spill_file(data)
+    return data
+
+
+def open_shared(handle: SharedContent, owned: bool = False) -> Content:
+    """
+    Content for a handle from share_content/share_result. Spill files are mapped, not read; pass owned=True when
+    receiving a worker result, so the file is removed with the content like any other spilled content.
+    """
+    if isinstance(handle, str):
+        return SpilledContent.from_file(handle, owned)
+    return store_content(handle) if owned else handle
+
+
+def _write_ipc(table: pa.Table) -> pa.Buffer:
+    """Writes an Arrow table as an LZ4-compressed Arrow IPC file into an Arrow buffer."""
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_file(sink, table.schema, options=IPC_WRITE_OPTIONS) as writer:
+        writer.write_table(table, max_chunksize=IPC_BATCH_ROWS)
+    return sink.getvalue()
+
+
+def store_arrow(table: pa.Table) -> Content:
+    """Serializes an Arrow table as an LZ4-compressed Arrow IPC file."""
+    content = store_content(_write_ipc(table))
+    if isinstance(content, bytes):
+        _cache_arrow_table(content, table) # The next read of this content (usually the preview) skips decoding
+    return content
+
+
+def _pandas_to_csv(df: pd.DataFrame) -> bytes:
+    """
+    CSV bytes of a frame. A fresh BytesIO per call on purpose: getvalue() hands over the
+    buffer without copying, and a pooled buffer would have to be copied out before reuse.
+    """
+    with io.BytesIO() as buffer:
+        df.to_csv(buffer, index=False)
+        return buffer.getvalue()
+
+
+def serialize_pandas(df: Union[pd.DataFrame, pd.Series]) -> Union[bytes, pa.Buffer]:
+    """
+    Serializes a pandas DataFrame (Series as one column) as Arrow IPC bytes.
+    Falls back to CSV for frames Arrow cannot type (e.g. mixed-type object columns).
+    The result is picklable (no spill file), so it can be produced in a worker process; see store_pandas.
+    """
+    if isinstance(df, pd.Series):
+        df = df.to_frame()
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError) as e:
+        print(f"Warning: Storing frame as CSV, Arrow conversion failed: {type(e).__name__}: {e}")
+        return _LZ4.compress(_pandas_to_csv(df), asbytes=True)
+    return _write_ipc(table)
+
+
+def store_pandas(df: Union[pd.DataFrame, pd.Series]) -> Content:
+    """Serializes a pandas DataFrame (Series as one column), see serialize_pandas."""
+    return store_content(serialize_pandas(df))
+
+
+def store_polars(df: pl.DataFrame) -> Content:
+    """Serializes a polars DataFrame as LZ4-compressed Arrow IPC (no text formatting/reparsing)."""
+    return store_arrow(df.to_arrow()) # Zero-copy hand-off; the IPC file is written straight into an Arrow buffer
+
+
+def spill(content: Content) -> Content:
+    """Moves in-memory content to a mmap-backed file (and drops its decoded table from the cache)."""
+    global _arrow_cache_bytes
+    if isinstance(content, SpilledContent):
+        return content
+    with _arrow_cache_lock:
+        cached = _arrow_cache.get(id(content))
+        if cached is not None and cached[0] is content:
+            del _arrow_cache[id(content)]
+            _arrow_cache_bytes -= cached[2]
+    return SpilledContent(content)
+
+
+def _has_magic(content: Content, magic: bytes) -> bool:
+    if isinstance(content, SpilledContent):
+        return bytes(content.view()[:len(magic)]) == magic
+    return bool(content) and content[:len(magic)] == magic
+
+
+def is_arrow_ipc(content: Content) -> bool:
+    """True if the stored content is an Arrow IPC file rather than CSV text."""
+    return _has_magic(content, ARROW_IPC_MAGIC)
+
+
+def _csv_source(content: Content):
+    """Readable source for CSV content; LZ4-framed CSV is decompressed while it is parsed."""
+    if _has_magic(content, LZ4_FRAME_MAGIC):
+        raw = pa.memory_map(content.path) if isinstance(content, SpilledContent) else pa.BufferReader(content)
+        return pa.CompressedInputStream(raw, "lz4")
+    return content.path if isinstance(content, SpilledContent) else io.BytesIO(content) # Spill files are read straight from the page cache
+
+
+# id(content) -> (content, table, nbytes). The entry holds the content itself, so its id cannot be
+# reused by another object while cached (bytes cannot be weakly referenced).
+_arrow_cache: "collections.OrderedDict[int, tuple]" = collections.OrderedDict()
+_arrow_cache_bytes = 0
+_arrow_cache_lock = threading.Lock()
+
+
+def _cache_arrow_table(content: bytes, table: pa.Table):
+    """Remembers the decoded table for content, evicting least recently used tables over budget."""
+    global _arrow_cache_bytes
+    size = table.nbytes
+    if size > ARROW_CACHE_BYTES:
+        return
+    with _arrow_cache_lock:
+        previous = _arrow_cache.pop(id(content), None)
+        if previous is not None:
+            _arrow_cache_bytes -= previous[2]
+        _arrow_cache[id(content)] = (content, table, size)
+        _arrow_cache_bytes += size
+        while _arrow_cache_bytes > ARROW_CACHE_BYTES:
+            _, (_, _, evicted_size) = _arrow_cache.popitem(last=False)
+            _arrow_cache_bytes -= evicted_size
+
+
+def _cached_arrow_table(content: bytes) -> Union[pa.Table, None]:
+    """The cached decoded table of content, if any (marks it most recently used)."""
+    with _arrow_cache_lock:
+        cached = _arrow_cache.get(id(content))
+        if cached is not None and cached[0] is content:
+            _arrow_cache.move_to_end(id(content))
+            return cached[1]
+    return None
+
+
+def _read_arrow_table(content: Content) -> pa.Table:
+    """Reads Arrow IPC content; spilled files are read through a memory map, other content via the cache."""
+    if isinstance(content, SpilledContent):
+        return pa.ipc.open_file(pa.memory_map(content.path)).read_all() # Not cached: spilled content should stay out of RAM
+    cached = _cached_arrow_table(content)
+    if cached is not None:
+        return cached
+    table = pa.ipc.open_file(pa.py_buffer(content)).read_all()
+    _cache_arrow_table(content, table)
+    return table
+
+
+def _read_csv_table(content: Content) -> pa.Table:
+    """
+    Parses CSV content into an Arrow table. In-memory content shares the decoded-table cache with
+    IPC content, so a CSV-fallback dataset is parsed once rather than on every read.
+    """
+    if not isinstance(content, SpilledContent):
+        cached = _cached_arrow_table(content)
+        if cached is not None:
+            return cached
+    df = pd.read_csv(_csv_source(content), engine="pyarrow", dtype_backend="pyarrow")
+    # All-empty columns come back as Arrow's null type; use float like the C parser did (all-NaN)
+    null_cols = [col for col, dtype in df.dtypes.items() if dtype == pd.ArrowDtype(pa.null())]
+    if null_cols:
+        df[null_cols] = df[null_cols].astype(pd.ArrowDtype(pa.float64()))
+    table = pa.Table.from_pandas(df, preserve_index=False) # Arrow-backed columns: no conversion, just unwrapped
+    if not isinstance(content, SpilledContent):
+        _cache_arrow_table(content, table)
+    return table
+
+
+def _pandas_column_names(names: List[str]) -> List[str]:
+    """Header names as pandas' C parser gives them: blanks become 'Unnamed: i', repeats get '.1', '.2', ..."""
+    result, seen = [], set()
+    for i, name in enumerate(names):
+        name = name if name else f"Unnamed: {i}"
+        candidate, suffix = name, 0
+        while candidate in seen:
+            suffix += 1
+            candidate = f"{name}.{suffix}"
+        seen.add(candidate)
+        result.append(candidate)
+    return result
+
+
+def parse_csv(data: bytes) -> pa.Table:
+    """
+    Parses uploaded CSV bytes with pyarrow's multi-threaded reader. Header names are de-duplicated like
+    pd.read_csv does, empty fields are missing values, dates/timestamps are kept as the original text
+    and all-empty columns are float; integer columns with gaps stay integers (pandas made them float).
+    Raises pa.ArrowInvalid for malformed or non-UTF-8 input.
+    """
+    read_options = pyarrow.csv.ReadOptions(use_threads=True, block_size=8 << 20)
+    convert_options = pyarrow.csv.ConvertOptions(strings_can_be_null=True)
+    table = pyarrow.csv.read_csv(pa.BufferReader(data), read_options=read_options, convert_options=convert_options)
+    temporal_names = [field.name for field in table.schema if pa.types.is_temporal(field.type)]
+    if temporal_names: # Rare; re-read so those columns keep their exact text
+        convert_options.column_types = {name: pa.string() for name in temporal_names}
+        table = pyarrow.csv.read_csv(pa.BufferReader(data), read_options=read_options, convert_options=convert_options)
+    columns = []
+    for column in table.columns:
+        if pa.types.is_binary(column.type):
+            raise pa.ArrowInvalid("CSV is not valid UTF-8 text")
+        columns.append(column.cast(pa.float64()) if pa.types.is_null(column.type) else column)
+    return pa.Table.from_arrays(columns, names=_pandas_column_names(table.column_names))
+
+
+def read_arrow(content: Content) -> pa.Table:
+    """Reads stored content as an Arrow table (zero-copy for IPC; CSV fallback is parsed once, then cached)."""
+    if is_arrow_ipc(content):
+        return _read_arrow_table(content)
+    return _read_csv_table(content)
+
+
+def to_bytes(content: Content) -> bytes:
+    """Materializes content as bytes."""
+    if isinstance(content, SpilledContent):
+        return bytes(content.view())
+    return content
+
+
+def to_csv_bytes(content: Content) -> bytes:
+    """Returns the content as CSV bytes (e.g. for export responses)."""
+    if is_arrow_ipc(content):
+        return _pandas_to_csv(read_pandas(content))
+    if _has_magic(content, LZ4_FRAME_MAGIC):
+        return _csv_source(content).read()
+    return to_bytes(content)
+
+
+def read_pandas(content: Content, **kwargs) -> pd.DataFrame:
+    """
+    Reads stored content (CSV or Arrow IPC) into an Arrow-backed pandas DataFrame.
+    CSV is parsed by pyarrow (multi-threaded); strings stay Arrow strings instead of Python objects.
+    """
+    if is_arrow_ipc(content):
+        return _read_arrow_table(content).to_pandas(types_mapper=pd.ArrowDtype)
+    if kwargs:
+        return pd.read_csv(_csv_source(content), engine="pyarrow", dtype_backend="pyarrow", **kwargs) # Custom parse, not cached
+    return _read_csv_table(content).to_pandas(types_mapper=pd.ArrowDtype)
+
+
+def _read_arrow_slice(content: Content, offset: int, limit: int) -> pa.Table:
+    """
+    Rows [offset, offset+limit) of Arrow IPC content. In-memory content is sliced from the
+    (cached) table; spilled content only decodes record batches until the page is covered.
+    """
+    if not isinstance(content, SpilledContent):
+        return _read_arrow_table(content).slice(offset, limit)
+    reader = pa.ipc.open_file(pa.memory_map(content.path))
+    end = offset + limit
+    batches, batch_start, first_start = [], 0, None
+    for i in range(reader.num_record_batches):
+        if batch_start >= end:
+            break
+        batch = reader.get_batch(i)
+        if batch_start + batch.num_rows > offset:
+            if first_start is None:
+                first_start = batch_start
+            batches.append(batch)
+        batch_start += batch.num_rows
+    if not batches:
+        return reader.schema.empty_table()
+    return pa.Table.from_batches(batches, schema=reader.schema).slice(offset - first_start, limit)
+
+
+def read_polars_slice(content: Content, offset: int, limit: int) -> pl.DataFrame:
+    """Reads only rows [offset, offset+limit) of the stored content into polars."""
+    if is_arrow_ipc(content):
+        return pl.from_arrow(_read_arrow_slice(content, offset, limit))
+    return pl.read_csv(_csv_source(content), skip_rows_after_header=offset, n_rows=limit)
+
+
+def read_polars(content: Content, **kwargs) -> pl.DataFrame:
+    """Reads stored content (CSV or Arrow IPC) into a polars DataFrame."""
+    if is_arrow_ipc(content):
+        return pl.from_arrow(_read_arrow_table(content))
+    if isinstance(content, SpilledContent) and not _has_magic(content, LZ4_FRAME_MAGIC):
+        return pl.read_csv(content.path, **kwargs) # Polars memory-maps the file itself
+    return pl.read_csv(_csv_source(content), **kwargs)
@@ -0,0 +1,112 @@
+import orjson
+from fastapi.testclient import TestClient
+
+from app.main import app, datasets_state, _duckdb
+
+client = TestClient(app)
+
+
+def test_apply_lambda_mixed_type_result_previews():
+    # The lambda leaves floats and strings in one object column, which Arrow cannot type
+    response = client.post("/upload-text", data={
+        "dataset_name": "mixed_lambda",
+        "data_text": "name,age\nann,30\nbob,20\ncid,\n",
+        "data_format": "csv",
+    })
+    assert response.status_code == 200, response.text
+
+    response = client.post("/apply-operation/mixed_lambda", data={
+        "operation": "apply_lambda",
+        "params_json": orjson.dumps({"column": "age", "lambda_str": "lambda x: x if x and x>28 else 'young'"}).decode(),
+        "engine": "pandas",
+    })
+    assert response.status_code == 200, response.text
+    body = response.json()
+    assert body["columns"] == ["name", "age"]
+    assert body["row_count"] == 3
+    assert [row["age"] for row in body["data"]] == ["30.0", "young", "young"]
+
+    datasets_state.pop("mixed_lambda", None)
+
+
+def test_sql_join_strategy_does_not_leak_optimizer_setting():
+    for name, text in (("join_left", "id,a\n1,x\n2,y\n"), ("join_right", "rid,b\n1,p\n3,q\n")):
+        response = client.post("/upload-text", data={"dataset_name": name, "data_text": text, "data_format": "csv"})
+        assert response.status_code == 200, response.text
+
+    response = client.post("/apply-operation/join_left", data={
+        "operation": "merge",
+        "params_json": orjson.dumps({"right_dataset": "join_right", "left_on": "id", "right_on": "rid", "join_strategy": "hash"}).decode(),
+        "engine": "sql",
+    })
+    assert response.status_code == 200, response.text
+    body = response.json()
+    assert body["row_count"] == 1
+    assert "SET disabled_optimizers" in body["generated_code"]
+    # Database-wide setting: must not outlive the request
+    assert _duckdb.execute("SELECT current_setting('disabled_optimizers')").fetchone()[0] == ""
+
+    for name in ("join_left", "join_right"):
+        datasets_state.pop(name, None)
+
+
+def test_concurrent_operations_on_one_dataset_all_apply():
+    import threading
+    from app import main
+
+    columns = [f"c{i}" for i in range(6)]
+    rows = "\n".join(",".join(str(i * j) for j in range(6)) for i in range(20000))
+    response = client.post("/upload-text", data={"dataset_name": "concurrent_ops", "data_text": ",".join(columns) + "\n" + rows, "data_format": "csv"})
+    assert response.status_code == 200, response.text
+
+    # Same path as /apply-operation: each request runs under the dataset's lock in a pool thread
+    def drop(column):
+        main._with_dataset_lock("concurrent_ops", main._apply_structured_operation, "concurrent_ops", "drop_columns",
+                                orjson.dumps({"drop_columns": [column]}).decode(), "pandas")
+
+    threads = [threading.Thread(target=drop, args=(column,)) for column in columns[1:]]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+
+    state_entry = datasets_state["concurrent_ops"]
+    assert state_entry["columns"] == ["c0"]
+    assert len(state_entry["history"]) == len(columns) - 1
+
+    datasets_state.pop("concurrent_ops", None)
+
+
+def test_sql_join_strategy_setting_not_seen_by_concurrent_queries():
+    import threading
+    import pyarrow as pa
+    from app.services import sql_service
+
+    n = 300000
+    tables = {
+        "__hint_left_base": pa.table({"id": pa.array(range(n)), "a": pa.array(range(n))}),
+        "__hint_right_base": pa.table({"rid": pa.array(range(0, 2 * n, 2)), "b": pa.array(range(n))}),
+    }
+    join_con = _duckdb.cursor()
+    for table_name, arrow_table in tables.items():
+        join_con.register(table_name, arrow_table)
+
+    results = {}
+    def hinted_join():
+        results["join"] = sql_service.apply_sql_join(
+            con=join_con, previous_sql_chain_left='SELECT * FROM "__hint_left_base"', right_table_ref='"__hint_right_base"',
+            params={"left_on": "id", "right_on": "rid", "join_strategy": "hash"}, base_table_ref_left="__hint_left_base",
+            materialize=True, tables=tables,
+        )
+
+    # A non-hinted query on the shared database, running while the hinted join executes
+    seen = set()
+    thread = threading.Thread(target=hinted_join)
+    probe = _duckdb.cursor()
+    thread.start()
+    while thread.is_alive():
+        seen.add(probe.execute("SELECT current_setting('disabled_optimizers')").fetchone()[0])
+    thread.join()
+    probe.close()
+    join_con.close()
+
+    assert results["join"][2] == n // 2
+    assert seen <= {""}